@@ -0,0 +1,120 @@
+import sqlite3
+
+from block import BlockFile
+from crypto_op import SCRIPT_P2PK, SCRIPT_P2TR
+from parallel import list_block_files
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (txid BLOB, vout INTEGER, addr TEXT, value INTEGER, time INTEGER);
+CREATE TABLE IF NOT EXISTS spends (txid BLOB, vout INTEGER, spending_txid BLOB, time INTEGER);
+CREATE TABLE IF NOT EXISTS progress (block_filename TEXT PRIMARY KEY, offset INTEGER);
+"""
+
+# Created once the bulk load is over, see AddressIndex.finish().
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS outputs_addr ON outputs (addr);
+CREATE INDEX IF NOT EXISTS spends_outpoint ON spends (txid, vout);
+"""
+
+_HISTORY = """
+SELECT o.txid, o.vout, o.value, o.time, s.spending_txid, s.time
+FROM outputs o LEFT JOIN spends s ON s.txid = o.txid AND s.vout = o.vout
+WHERE o.addr = ? ORDER BY o.time
+"""
+
+_BALANCE = """
+SELECT COALESCE(SUM(o.value), 0)
+FROM outputs o LEFT JOIN spends s ON s.txid = o.txid AND s.vout = o.vout
+WHERE o.addr = ? AND s.txid IS NULL
+"""
+
+_COINBASE = 0xffffffff
+
+
+class AddressIndex:
+    """
+    Per-address history in a SQLite database: one row per output paying a
+    P2PK, P2PKH, P2SH or segwit address and one per spent outpoint.
+
+    Rows are written with executemany() in transactions of about
+    batch_size rows, together with the offset of the next block of the blk
+    file, so an interrupted run resumes after the last committed block.
+    The lookup indexes are only built by finish(), after the bulk load.
+    """
+    def __init__(self, db_filename, batch_size=200000):
+        self.db_filename = db_filename
+        self.batch_size = batch_size
+        self.db = sqlite3.connect(db_filename)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA cache_size=-262144")
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def get_offset(self, block_filename):
+        """ Offset where indexing of block_filename resumes, 0 if it was never indexed. """
+        row = self.db.execute("SELECT offset FROM progress WHERE block_filename = ?",
+                              (block_filename,)).fetchone()
+        return row[0] if row else 0
+
+    def _commit(self, outputs, spends, block_filename, offset):
+        db = self.db
+        with db:
+            db.executemany("INSERT INTO outputs VALUES (?, ?, ?, ?, ?)", outputs)
+            db.executemany("INSERT INTO spends VALUES (?, ?, ?, ?)", spends)
+            db.execute("INSERT OR REPLACE INTO progress VALUES (?, ?)", (block_filename, offset))
+        outputs.clear()
+        spends.clear()
+
+    def index_file(self, block_filename):
+        """ Indexes the blocks of block_filename not indexed yet, returns their count. """
+        block_file = BlockFile(block_filename, lazy=True)
+        offset = self.get_offset(block_filename)
+        block_file.cursor.seek(offset)
+        outputs = []
+        spends = []
+        count = 0
+        for block in block_file.get_next_block():
+            time = block.block_header.time
+            for tx in block:
+                txid = tx.tx_hash_raw
+                for tx_input in tx.inputs:
+                    if tx_input.tx_outId != _COINBASE:
+                        spends.append((bytes(tx_input.prev_hash_raw), tx_input.tx_outId, txid, time))
+                for vout, tx_output in enumerate(tx.outputs):
+                    if SCRIPT_P2PK <= tx_output.script_type <= SCRIPT_P2TR:
+                        outputs.append((txid, vout, tx_output.addr, tx_output.value, time))
+            count += 1
+            offset = block.end_pos
+            if len(outputs) + len(spends) >= self.batch_size:
+                self._commit(outputs, spends, block_filename, offset)
+        self._commit(outputs, spends, block_filename, offset)
+        return count
+
+    def index_directory(self, directory, pattern='blk*.dat'):
+        """ index_file() of every blk file of directory, then finish(). """
+        count = 0
+        for block_filename in list_block_files(directory, pattern):
+            count += self.index_file(block_filename)
+        self.finish()
+        return count
+
+    def finish(self):
+        """ Builds the lookup indexes, once the bulk load is done. """
+        self.db.executescript(_INDEXES)
+        self.db.execute("ANALYZE")
+
+    def history(self, addr):
+        """
+        (txid, vout, value, time, spending txid or None, spending time or
+        None) of every output paid to addr, txids as reversed hex.
+        """
+        return [(txid[::-1].hex(), vout, value, time,
+                 spending_txid[::-1].hex() if spending_txid is not None else None, spent_time)
+                for txid, vout, value, time, spending_txid, spent_time in self.db.execute(_HISTORY, (addr,))]
+
+    def balance(self, addr):
+        """ Sum of the unspent outputs paid to addr, in satoshi. """
+        return self.db.execute(_BALANCE, (addr,)).fetchone()[0]
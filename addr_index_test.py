@@ -0,0 +1,35 @@
+import os
+import tempfile
+import unittest
+from addr_index import AddressIndex
+
+GENESIS_ADDR = "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa"
+
+class TestAddressIndex(unittest.TestCase):
+
+    def test_index_and_resume(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_filename = os.path.join(tmp, "addr.db")
+            index = AddressIndex(db_filename, batch_size=1000)
+            self.assertEqual(index.index_file("1M.dat"), 4522)
+            rows = index.db.execute("SELECT COUNT(*) FROM outputs").fetchone()[0]
+            index.close()
+            # Reopened, it resumes after the last indexed block.
+            index = AddressIndex(db_filename)
+            self.assertEqual(index.index_file("1M.dat"), 0)
+            self.assertEqual(index.db.execute("SELECT COUNT(*) FROM outputs").fetchone()[0], rows)
+            index.finish()
+            history = index.history(GENESIS_ADDR)
+            self.assertEqual(history[0][:4], ("4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b",
+                                              0, 5000000000, 1231006505))
+            self.assertIsNone(history[0][4])
+            self.assertEqual(index.balance(GENESIS_ADDR), 5000000000)
+            self.assertEqual(index.balance("1BitcoinEaterAddressDontSendf59kuE"), 0)
+            # The block 9 coinbase, spent by the first bitcoin transaction in block 170.
+            history = index.history("12cbQLTFMXRnSzktFkuoG3eHoMeFtpTu3S")
+            self.assertEqual(history[0][4], "f4184fc596403b9d638783cf57adfe4c75c605f6356fbc91338530e9831e9e16")
+            index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
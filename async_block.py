@@ -0,0 +1,163 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+
+from block import BlockFile
+from parallel import scan_block_file
+
+# Queue item marking the end of a file.
+_DONE = object()
+
+
+class _Failed:
+    def __init__(self, error):
+        self.error = error
+
+
+def _check_executor(executor):
+    """ The blocks and the block generator cannot be pickled, so no process pool. """
+    if executor is not None and not isinstance(executor, ThreadPoolExecutor):
+        raise TypeError("executor must be a ThreadPoolExecutor, not %s (for a process pool see scan_files_async())"
+                        % type(executor).__name__)
+
+
+async def _produce(queue, block_filename, lazy, batch_blocks, executor):
+    """
+    Parses block_filename batch_blocks blocks at a time in executor and
+    puts (block_filename, block) on queue, waiting while it is full, then
+    (block_filename, _DONE). At most one batch is being parsed, the
+    generator cannot be resumed from two threads.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        block_file = await loop.run_in_executor(executor, BlockFile, block_filename, lazy)
+        blocks = block_file.get_next_block()
+        while True:
+            batch = await loop.run_in_executor(executor, list, islice(blocks, batch_blocks))
+            if not batch:
+                break
+            for block in batch:
+                await queue.put((block_filename, block))
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        await queue.put((block_filename, _Failed(e)))
+        return
+    await queue.put((block_filename, _DONE))
+
+
+class AsyncBlockFile:
+    """
+    Async iterator over the blocks of a blk file:
+
+        async for block in AsyncBlockFile("blk00000.dat"):
+            ...
+
+    The file is parsed in a worker thread (executor, a ThreadPoolExecutor
+    only, the loop's default one if None) batch_blocks blocks at a time, and at most prefetch blocks
+    wait for the consumer, so a slow consumer holds the parsing back. The
+    event loop only ever waits on the queue. Leaving the loop early or
+    cancelling the consuming task stops the parsing after the batch under
+    way.
+
+    With the default lazy=False the transactions are decoded in the
+    thread too; lazy blocks would decode them on the event loop when
+    accessed.
+    """
+    def __init__(self, block_filename, lazy=False, prefetch=64, batch_blocks=16, executor=None):
+        _check_executor(executor)
+        self.block_filename = block_filename
+        self.lazy = lazy
+        self.prefetch = prefetch
+        self.batch_blocks = batch_blocks
+        self.executor = executor
+
+    async def __aiter__(self):
+        queue = asyncio.Queue(self.prefetch)
+        producer = asyncio.ensure_future(
+            _produce(queue, self.block_filename, self.lazy, self.batch_blocks, self.executor))
+        try:
+            while True:
+                _, item = await queue.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failed):
+                    raise item.error
+                yield item
+        finally:
+            producer.cancel()
+
+
+async def interleave_block_files(block_filenames, lazy=False, max_files=4, prefetch=64,
+                                 batch_blocks=16, executor=None):
+    """
+    Yields (block_filename, block) from up to max_files files parsed at
+    the same time, each file's blocks in order but the files interleaved
+    as their blocks get ready. Same prefetch and cancellation behaviour as
+    AsyncBlockFile, with prefetch shared by all the files.
+    """
+    _check_executor(executor)
+    queue = asyncio.Queue(prefetch)
+    pending = list(reversed(block_filenames))
+    running = {}
+
+    def start_next():
+        if pending:
+            block_filename = pending.pop()
+            running[block_filename] = asyncio.ensure_future(
+                _produce(queue, block_filename, lazy, batch_blocks, executor))
+
+    try:
+        for _ in range(max_files):
+            start_next()
+        while running:
+            block_filename, item = await queue.get()
+            if isinstance(item, _Failed):
+                raise item.error
+            if item is _DONE:
+                del running[block_filename]
+                start_next()
+                continue
+            yield block_filename, item
+    finally:
+        for task in running.values():
+            task.cancel()
+
+
+async def scan_files_async(block_filenames, func, reducer=None, initial=None, workers=None, lazy=False):
+    """
+    parallel.scan_directory() for asyncio: scan_block_file() of each file
+    on a process pool, yielding (block_filename, result) as files complete.
+    At most 2 * workers files are submitted at a time, so the pool stays
+    busy without queueing the whole directory; when the consumer stops, the
+    files not started yet are dropped and the loop does not wait for the
+    ones under way.
+    """
+    loop = asyncio.get_running_loop()
+    workers = workers or os.cpu_count() or 1
+    pending = iter(block_filenames)
+    in_flight = {}
+    # Not a with block: its exit would wait for the running scans on the loop.
+    executor = ProcessPoolExecutor(max_workers=workers)
+
+    def submit():
+        block_filename = next(pending, None)
+        if block_filename is not None:
+            future = loop.run_in_executor(executor, scan_block_file, block_filename, func, reducer, initial, lazy)
+            in_flight[future] = block_filename
+
+    try:
+        for _ in range(2 * workers):
+            submit()
+        while in_flight:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                block_filename = in_flight.pop(future)
+                submit()
+                yield block_filename, future.result()
+    finally:
+        for future in in_flight:
+            future.cancel()
+        # The scans under way finish in the background, their results dropped.
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,102 @@
+import asyncio
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from async_block import AsyncBlockFile, interleave_block_files, scan_files_async
+from block import BlockFile
+
+def count_txs(block):
+    return block.tx_count
+
+def add(acc, n):
+    return acc + n
+
+def slow_count_txs(block):
+    # Only the block of blk01234.001 has that many txs.
+    if block.tx_count > 10:
+        time.sleep(2)
+    return block.tx_count
+
+class TestAsyncBlockFile(unittest.TestCase):
+
+    def test_same_blocks(self):
+        async def collect():
+            return [block.block_header.block_hash async for block in AsyncBlockFile("1M.dat", prefetch=4)]
+        expected = [block.block_header.block_hash for block in BlockFile("1M.dat").get_next_block()]
+        self.assertEqual(asyncio.run(collect()), expected)
+
+    def test_backpressure_and_early_exit(self):
+        async def take(n):
+            blocks = AsyncBlockFile("1M.dat", prefetch=2, batch_blocks=1)
+            hashes = []
+            async for block in blocks:
+                # The loop keeps running between blocks.
+                await asyncio.sleep(0)
+                hashes.append(block.block_header.block_hash)
+                if len(hashes) == n:
+                    break
+            return hashes
+        self.assertEqual(len(asyncio.run(take(3))), 3)
+
+    def test_missing_file(self):
+        async def collect():
+            return [block async for block in AsyncBlockFile("no_such_file.dat")]
+        with self.assertRaises(OSError):
+            asyncio.run(collect())
+
+    def test_executor(self):
+        async def collect(executor):
+            return [block.tx_count async for block in AsyncBlockFile("blk01234.001", executor=executor)]
+        with ThreadPoolExecutor(1) as executor:
+            self.assertEqual(len(asyncio.run(collect(executor))), 1)
+        # Fails up front, not on pickling a block generator.
+        with ProcessPoolExecutor(1) as executor:
+            with self.assertRaises(TypeError):
+                AsyncBlockFile("1M.dat", executor=executor)
+            with self.assertRaises(TypeError):
+                asyncio.run(interleave_block_files(["1M.dat"], executor=executor).__anext__())
+
+    def test_interleave(self):
+        async def collect():
+            return [(name, block.tx_count)
+                    async for name, block in interleave_block_files(["1M.dat", "blk01234.001"], max_files=2)]
+        results = asyncio.run(collect())
+        for name in ("1M.dat", "blk01234.001"):
+            expected = [block.tx_count for block in BlockFile(name).get_next_block()]
+            self.assertEqual([n for f, n in results if f == name], expected)
+
+    def test_scan_files(self):
+        async def collect():
+            return dict([item async for item in scan_files_async(["1M.dat", "blk01234.001"], count_txs, add, 0,
+                                                                  workers=2, lazy=True)])
+        results = asyncio.run(collect())
+        self.assertEqual(results["1M.dat"], sum(block.tx_count for block in BlockFile("1M.dat", True).get_next_block()))
+        self.assertEqual(set(results), {"1M.dat", "blk01234.001"})
+
+    def test_scan_files_early_exit(self):
+        async def heartbeat(beats):
+            while True:
+                beats.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        async def first_result():
+            beats = []
+            ticker = asyncio.ensure_future(heartbeat(beats))
+            results = scan_files_async(["1M.dat", "blk01234.001"], slow_count_txs, add, 0, workers=2, lazy=True)
+            async for block_filename, _ in results:
+                break
+            await results.aclose()
+            closed = time.monotonic()
+            await asyncio.sleep(0.1)
+            ticker.cancel()
+            return block_filename, closed, beats
+
+        block_filename, closed, beats = asyncio.run(first_result())
+        self.assertEqual(block_filename, "1M.dat")
+        # The loop kept beating while blk01234.001 was still being scanned.
+        self.assertGreater(len([beat for beat in beats if beat > closed]), 3)
+        self.assertLess(max(b - a for a, b in zip(beats, beats[1:])), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+# Base58 and Base58Check, see
+# https://en.bitcoin.it/wiki/Base58Check_encoding
+
+import hashlib
+
+ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+_INDEX = {c: i for i, c in enumerate(ALPHABET)}
+
+# Two digits per lookup: _PAIRS[n] is n < 58 * 58 written with two digits.
+_PAIRS = [a + b for a in ALPHABET for b in ALPHABET]
+_CHUNK = 58 ** 10
+
+
+def _digits(n):
+    """ n in base58, most significant digit first, left padded with '1' to a multiple of 10. """
+    pairs = _PAIRS
+    chunks = []
+    while n:
+        n, chunk = divmod(n, _CHUNK)
+        # chunk fits a machine word, split it with small int divisions.
+        chunk, d4 = divmod(chunk, 3364)
+        chunk, d3 = divmod(chunk, 3364)
+        chunk, d2 = divmod(chunk, 3364)
+        d0, d1 = divmod(chunk, 3364)
+        chunks.append(pairs[d0] + pairs[d1] + pairs[d2] + pairs[d3] + pairs[d4])
+    chunks.reverse()
+    return ''.join(chunks)
+
+
+def b58encode(data):
+    """ Base58 of data (a bytes-like object), one '1' per leading zero byte. """
+    data = bytes(data)
+    stripped = data.lstrip(b'\0')
+    return '1' * (len(data) - len(stripped)) + _digits(int.from_bytes(stripped, 'big')).lstrip('1')
+
+
+def b58decode(text):
+    n = 0
+    index = _INDEX
+    try:
+        for c in text:
+            n = n * 58 + index[c]
+    except KeyError:
+        raise ValueError("invalid base58 character in %r" % text)
+    stripped = text.lstrip('1')
+    body = n.to_bytes((n.bit_length() + 7) // 8, 'big')
+    return b'\0' * (len(text) - len(stripped)) + body
+
+
+def checksum(data):
+    """ First 4 bytes of the double SHA256 of data. """
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()[:4]
+
+
+def encode(data):
+    """ Base58Check of data, the version byte(s) followed by the payload. """
+    data = bytes(data)
+    return b58encode(data + checksum(data))
+
+
+def decode(text):
+    """ Version + payload of a Base58Check string, ValueError if the checksum fails. """
+    data = b58decode(text)
+    if len(data) < 4 or checksum(data[:-4]) != data[-4:]:
+        raise ValueError("bad base58check checksum in %r" % text)
+    return data[:-4]
+
+
+def encode_many(payloads):
+    """
+    encode() of a batch of payloads, made for 21-byte version + hash160
+    ones. With the checksum those are 25 bytes, below 58**40, so each
+    number is split into four 58**10 chunks in one go; longer payloads go
+    through b58encode(). As there, every leading zero byte is a '1', so
+    the length of the result depends on the payload length and its leading
+    zero bytes, it is not a fixed number of digits.
+    """
+    sha256 = hashlib.sha256
+    from_bytes = int.from_bytes
+    pairs = _PAIRS
+    result = []
+    for payload in payloads:
+        data = bytes(payload)
+        data += sha256(sha256(data).digest()).digest()[:4]
+        if len(data) > 25:
+            result.append(b58encode(data))
+            continue
+        n = from_bytes(data, 'big')
+        n, c3 = divmod(n, _CHUNK)
+        n, c2 = divmod(n, _CHUNK)
+        c0, c1 = divmod(n, _CHUNK)
+        digits = []
+        for chunk in (c0, c1, c2, c3):
+            chunk, d4 = divmod(chunk, 3364)
+            chunk, d3 = divmod(chunk, 3364)
+            chunk, d2 = divmod(chunk, 3364)
+            d0, d1 = divmod(chunk, 3364)
+            digits.append(pairs[d0] + pairs[d1] + pairs[d2] + pairs[d3] + pairs[d4])
+        text = ''.join(digits).lstrip('1')
+        if data[0] == 0:
+            zeros = len(data) - len(data.lstrip(b'\0'))
+            text = '1' * zeros + text
+        result.append(text)
+    return result
@@ -0,0 +1,28 @@
+import unittest
+import base58check
+
+class TestBase58Check(unittest.TestCase):
+
+    def test_b58encode(self):
+        self.assertEqual(base58check.b58encode(b""), "")
+        self.assertEqual(base58check.b58encode(b"\0\0\x01"), "112")
+        self.assertEqual(base58check.b58encode(b"hello world"), "StV1DL6CwTryKyV")
+        self.assertEqual(base58check.b58decode("StV1DL6CwTryKyV"), b"hello world")
+        self.assertEqual(base58check.b58decode("112"), b"\0\0\x01")
+
+    def test_encode_address(self):
+        payload = bytes.fromhex("0062e907b15cbf27d5425399ebf6f0fb50ebb88f18")
+        self.assertEqual(base58check.encode(payload), "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa")
+        self.assertEqual(base58check.decode("1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa"), payload)
+        with self.assertRaises(ValueError):
+            base58check.decode("1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNb")
+
+    def test_encode_many(self):
+        payloads = [bytes([version]) + bytes([i]) * 20 for version in (0, 5, 0x6f) for i in range(0, 256, 15)]
+        # All zeros, several leading zero bytes, the largest 21 bytes, and other lengths.
+        payloads += [b"\0" * 21, b"\0\0\0" + b"\1" * 18, b"\xff" * 21, b"\5" * 5, b"\x80" + b"\x11" * 33]
+        self.assertEqual(base58check.encode_many(payloads), [base58check.encode(p) for p in payloads])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# Bech32 (BIP173) and Bech32m (BIP350) segwit addresses, see
+# https://github.com/bitcoin/bips/blob/master/bip-0173.mediawiki
+# https://github.com/bitcoin/bips/blob/master/bip-0350.mediawiki
+
+CHARSET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+_INDEX = {c: i for i, c in enumerate(CHARSET)}
+
+BECH32_CONST = 1
+BECH32M_CONST = 0x2bc830a3
+
+_GENERATOR = (0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3)
+
+
+def _polymod(values):
+    chk = 1
+    for v in values:
+        top = chk >> 25
+        chk = (chk & 0x1ffffff) << 5 ^ v
+        for i in range(5):
+            if (top >> i) & 1:
+                chk ^= _GENERATOR[i]
+    return chk
+
+
+def _hrp_expand(hrp):
+    return [ord(c) >> 5 for c in hrp] + [0] + [ord(c) & 31 for c in hrp]
+
+
+def _convert_bits(data, from_bits, to_bits, pad):
+    acc = 0
+    bits = 0
+    result = []
+    maxv = (1 << to_bits) - 1
+    for value in data:
+        acc = (acc << from_bits) | value
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            result.append((acc >> bits) & maxv)
+    if pad:
+        if bits:
+            result.append((acc << (to_bits - bits)) & maxv)
+    elif bits >= from_bits or ((acc << (to_bits - bits)) & maxv):
+        return None
+    return result
+
+
+def encode(hrp, witver, witprog):
+    """ Segwit address of a witness program, Bech32m from version 1 on. """
+    const = BECH32_CONST if witver == 0 else BECH32M_CONST
+    data = [witver] + _convert_bits(bytes(witprog), 8, 5, True)
+    polymod = _polymod(_hrp_expand(hrp) + data + [0] * 6) ^ const
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + '1' + ''.join(CHARSET[d] for d in data + checksum)
+
+
+def decode(hrp, addr):
+    """ (witver, witprog) of a segwit address, ValueError if it is not valid for hrp. """
+    addr = addr.lower()
+    pos = addr.rfind('1')
+    if addr[:pos] != hrp or pos + 7 > len(addr):
+        raise ValueError("not a %s segwit address: %r" % (hrp, addr))
+    try:
+        data = [_INDEX[c] for c in addr[pos + 1:]]
+    except KeyError:
+        raise ValueError("invalid bech32 character in %r" % addr)
+    witver = data[0]
+    const = _polymod(_hrp_expand(hrp) + data)
+    if const != (BECH32_CONST if witver == 0 else BECH32M_CONST):
+        raise ValueError("bad bech32 checksum in %r" % addr)
+    witprog = _convert_bits(data[1:-6], 5, 8, False)
+    if witprog is None or not 2 <= len(witprog) <= 40:
+        raise ValueError("bad witness program in %r" % addr)
+    return witver, bytes(witprog)
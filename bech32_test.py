@@ -0,0 +1,22 @@
+import unittest
+import bech32
+
+class TestBech32(unittest.TestCase):
+
+    def test_p2wpkh(self):
+        program = bytes.fromhex("751e76e8199196d454941c45d1b3a323f1433bd6")
+        addr = bech32.encode("bc", 0, program)
+        self.assertEqual(addr, "bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4")
+        self.assertEqual(bech32.decode("bc", addr), (0, program))
+
+    def test_p2tr_bech32m(self):
+        program = bytes.fromhex("79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798")
+        addr = bech32.encode("bc", 1, program)
+        self.assertEqual(addr, "bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vqzk5jj0")
+        self.assertEqual(bech32.decode("bc", addr), (1, program))
+        with self.assertRaises(ValueError):
+            bech32.decode("bc", addr[:-1] + "1")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,33 +1,284 @@
 from crypto_lib import *
 from crypto_op import *
+from block_index import BlockIndex
 from datetime import datetime
+from functools import cached_property
+import hashlib
 import os
 import mmap
 
+# Bytes of an obfuscated blk file de-obfuscated at a time when scanning it.
+XOR_WINDOW = 1 << 25
+
+
 class BlockFile:
-    """The block file class, which holds a file pointer."""
-    def __init__(self, block_filename):
+    """The block file class, which holds a file pointer.
+
+    With lazy=True the blocks only decode their header and tx_count, the
+    transactions are parsed when Block.txs is accessed or iterated.
+
+    The XOR key of obfuscated blk files is read from xor.dat next to the
+    file unless given as xor_key. Those files are de-obfuscated
+    XOR_WINDOW bytes at a time as they are scanned, and block by block for
+    random access, never as a whole.
+
+    Zero padding and damaged spans between blocks are skipped, see
+    crypto_lib.find_block(); skipped holds the (start, end) ranges passed
+    over by the last scan.
+    """
+    def __init__(self, block_filename, lazy=False, xor_key=None):
         self.block_filename = block_filename
+        self.lazy = lazy
         with open(block_filename, 'rb', buffering=16 * 1024 * 1024) as f:
             size = os.path.getsize(f.name)
             self.blockchain = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        if xor_key is None:
+            xor_key = read_xor_key(os.path.dirname(os.path.abspath(block_filename)))
+        self.xor_key = xor_key if xor_key and xor_key.strip(b'\0') else None
+        # The last de-obfuscated part of the file, (file offset, bytes).
+        self.window = (0, b'')
+        # Only holds the position of get_next_block().
+        self.cursor = Cursor(self.blockchain)
+        self.index = None
+        self.skipped = []
+        # Resync on the magic number of the file's network once it is known.
+        self.magic = None
+        buf, pos = self._read(0, 4)
+        if len(buf) >= pos + 4 and unpack_uint4(buf, pos)[0] in NETWORK_MAGICS:
+            self.magic = bytes(buf[pos:pos + 4])
+
+    def _read(self, offset, length, window=0):
+        """
+        (buf, pos) where buf[pos:pos + length] are the (de-obfuscated) bytes
+        at offset in the file, fewer at its end. For an obfuscated file the
+        last window is reused if it holds them, else max(length, window)
+        bytes are decoded from offset on.
+        """
+        if self.xor_key is None:
+            return self.blockchain, offset
+        end = min(offset + length, len(self.blockchain))
+        base, buf = self.window
+        if not base <= offset or end > base + len(buf):
+            end = min(offset + max(length, window), len(self.blockchain))
+            base, buf = self.window = offset, xor_bytes(self.blockchain[offset:end], self.xor_key, offset)
+        return buf, offset - base
+
+    def _block_size(self, offset):
+        buf, pos = self._read(offset, 8)
+        return unpack_uint4(buf, pos + 4)[0]
+
+    def _find_block(self, pos, skipped=None):
+        """ find_block() on the file, window by window if it is obfuscated. """
+        if self.xor_key is None:
+            return find_block(self.blockchain, pos, skipped, self.magic)
+        size = len(self.blockchain)
+        # A block and the 4 bytes after it, as is_block_at() reads them.
+        reach = 8 + MAX_BLOCK_SIZE + 4
+        while pos + 8 <= size:
+            base, buf = self.window
+            # Blocks starting from limit on may not be all in the window.
+            limit = len(buf) if base + len(buf) == size else len(buf) - reach + 1
+            if not base <= pos < base + limit:
+                self._read(pos, reach, XOR_WINDOW)
+                continue
+            window_skipped = [] if skipped is not None else None
+            found = find_block(buf, pos - base, window_skipped, self.magic, limit)
+            if window_skipped:
+                for start, end in window_skipped:
+                    if skipped and skipped[-1][1] == base + start:
+                        skipped[-1] = (skipped[-1][0], base + end)
+                    else:
+                        skipped.append((base + start, base + end))
+            if found is not None:
+                return base + found
+            pos = base + limit
+        return None
+
+    def _block_at(self, offset, lazy):
+        """ Decodes the block at offset, with file offsets in start_pos and end_pos. """
+        if self.xor_key is None:
+            return Block(Cursor(self.blockchain, offset), lazy)
+        buf, pos = self._read(offset, 8)
+        if pos + 8 + unpack_uint4(buf, pos + 4)[0] > len(buf):
+            buf, pos = self._read(offset, 8 + unpack_uint4(buf, pos + 4)[0])
+        block = Block(Cursor(buf, pos), lazy)
+        block.start_pos += offset - pos
+        block.end_pos += offset - pos
+        return block
+
+    def get_index(self, index_filename=None):
+        """
+        Opens the sidecar index (block_filename + '.idx' by default) and
+        brings it up to date with the blocks in the file.
+        """
+        if self.index is None:
+            self.index = BlockIndex(index_filename or self.block_filename + '.idx')
+        self.index.add_blocks(len(self.blockchain), self._index_records)
+        return self.index
+
+    def _index_records(self, pos):
+        while True:
+            pos = self._find_block(pos)
+            if pos is None:
+                return
+            block_size = self._block_size(pos)
+            buf, buf_pos = self._read(pos, 88)
+            yield pos, block_size, bytes(buf[buf_pos + 8:buf_pos + 88])
+            pos += 8 + block_size
+
+    def get_block_offsets(self, offset=0):
+        """
+        Offsets of the complete blocks in the file from offset on, found by
+        reading only the 8-byte magic/size prefix of each block.
+        """
+        offsets = []
+        skipped = []
+        pos = offset
+        while True:
+            pos = self._find_block(pos, skipped)
+            if pos is None:
+                break
+            offsets.append(pos)
+            pos += 8 + self._block_size(pos)
+        self.skipped = skipped
+        return offsets
+
+    def verify_merkle(self, workers=None):
+        """
+        Checks the merkle root of every block in the file, returns the start
+        offsets of the blocks that do not match. With workers the blocks are
+        checked on a process pool, see parallel.verify_merkle_file().
+        """
+        if workers:
+            from parallel import verify_merkle_file
+            return verify_merkle_file(self.block_filename, workers, xor_key=self.xor_key)
+        mismatches = []
+        for offset in self.get_block_offsets():
+            block = self._block_at(offset, lazy=True)
+            if not block.verify_merkle():
+                mismatches.append(block.start_pos)
+        return mismatches
+
+    def export_columns(self, directory, batch_blocks=10000):
+        """
+        Writes the blocks, txs, inputs and outputs of the file as .npy
+        column batches under directory, see export.export_blocks().
+        """
+        from export import export_blocks
+        blocks = (self._block_at(offset, True) for offset in self.get_block_offsets())
+        return export_blocks(blocks, directory, batch_blocks)
+
+    def iter_blocks(self, start=None, stop=None, min_time=None, max_time=None, offset=0):
+        """
+        Yields (number, block) for the blocks numbered start to stop - 1 in
+        file order whose header time is within [min_time, max_time]. The
+        range and the time are checked on the block prefixes and the raw
+        header, skipped blocks are never decoded. With an offset, e.g. from
+        a checkpoint, the scan starts there and the block at offset is
+        number 0.
+        """
+        offsets = self.get_block_offsets(offset)
+        check_time = min_time is not None or max_time is not None
+        for number in range(*slice(start, stop).indices(len(offsets))):
+            offset = offsets[number]
+            if check_time:
+                # Magic and size, then version, previous hash and merkle root precede the time.
+                buf, pos = self._read(offset, 88)
+                time = unpack_uint4(buf, pos + 8 + 68)[0]
+                if (min_time is not None and time < min_time) or (max_time is not None and time > max_time):
+                    continue
+            yield number, self._block_at(offset, self.lazy)
+
+    def follow(self, offset=0, poll_interval=0.25, idle_timeout=None):
+        """ Tails the file as the node appends to it, see follow.BlockFollower. """
+        from follow import BlockFollower
+        return BlockFollower(self.block_filename, offset, self.lazy, poll_interval, idle_timeout, self.xor_key)
+
+    def get_block_at(self, offset):
+        """ Decodes the block whose magic number is at offset. """
+        return self._block_at(offset, self.lazy)
+
+    def get_block_by_hash(self, block_hash):
+        """ Looks block_hash (hex string or bytes) up in the index, None if absent. """
+        if self.index is None:
+            self.get_index()
+        entry = self.index.find(block_hash)
+        if entry is None:
+            return None
+        return self.get_block_at(entry.offset)
 
     def get_next_block(self):
+        self.skipped = []
+        cursor = self.cursor
         while True:
-            block = Block(self.blockchain)
-            if block.is_ready:
-                yield block
-            else:
+            pos = self._find_block(cursor.pos, self.skipped)
+            if pos is None:
                 break
+            if self.xor_key is None:
+                cursor.seek(pos)
+                yield Block(cursor, self.lazy)
+                continue
+            # The window the block was found in holds all of it.
+            base, buf = self.window
+            block = Block(Cursor(buf, pos - base), self.lazy)
+            block.start_pos += base
+            block.end_pos += base
+            cursor.seek(block.end_pos)
+            yield block
+
+class OutputFilter:
+    """
+    Selects outputs by script type and/or paid address. Both are checked on
+    the raw script bytes: the addresses are turned into the scripts paying
+    them up front, so no address is derived and nothing is segmented for
+    the outputs that do not match. A P2PKH address also matches the P2PK
+    outputs of its key, those pubkeys get hashed.
+    """
+    def __init__(self, script_types=None, addresses=None):
+        self.script_types = frozenset(script_types) if script_types is not None else None
+        self.scripts = None
+        if addresses is not None:
+            self.scripts = set()
+            self.pubkey_hashes = set()
+            for addr in addresses:
+                script = address_to_script(addr)
+                self.scripts.add(script)
+                if len(script) == 25:
+                    self.pubkey_hashes.add(script[3:23])
+            self.script_lengths = frozenset(len(script) for script in self.scripts)
+
+    def match(self, tx_output):
+        script = tx_output.script_raw
+        if self.scripts is not None:
+            n = len(script)
+            if n in self.script_lengths and bytes(script) in self.scripts:
+                pass
+            elif (n == 35 or n == 67) and self.pubkey_hashes and tx_output.script_type == SCRIPT_P2PK:
+                if hash160_digest(tx_output.payload) not in self.pubkey_hashes:
+                    return False
+            else:
+                return False
+        return self.script_types is None or tx_output.script_type in self.script_types
+
+    def outputs(self, tx):
+        """ (index, output) of the outputs of tx that match. """
+        return [(i, tx_output) for i, tx_output in enumerate(tx.outputs) if self.match(tx_output)]
+
 
 class BlockHeader:
-    def __init__(self, blockchain):
-        self.version = uint4(blockchain)
-        self.previous_hash = hash32(blockchain)
-        self.merkle_hash = hash32(blockchain)
-        self.time = uint4(blockchain)
-        self.bits = uint4(blockchain)
-        self.nonce = uint4(blockchain)
+    def __init__(self, cursor):
+        (self.version, previous_hash, merkle_hash,
+         self.time, self.bits, self.nonce) = unpack_header(cursor.buf, cursor.pos)
+        # Same byte order as hash32().
+        self.previous_hash = previous_hash[::-1]
+        self.merkle_hash = merkle_hash[::-1]
+        self.raw_bytes = cursor.buf[cursor.pos:cursor.pos + 80]
+        cursor.pos += 80
+
+    @property
+    def block_hash(self):
+        """ The block hash, same byte order as previous_hash. """
+        return sha256d(self.raw_bytes)[::-1]
 
     def to_string(self):
         sb = []
@@ -45,51 +296,80 @@ class BlockHeader:
 
 
 class Block:
-    def __init__(self, blockchain):
-        self.blockchain = blockchain
+    def __init__(self, cursor, lazy=False):
+        self.blockchain = cursor
         self.is_ready = True
         self.magic_num = 0
         self.block_size = 0
         self.block_header = ''
         self.tx_count = 0
-        self.txs = []
+        self._txs = []
+        # The block occupies [start_pos, end_pos) in the file, magic included.
+        self.start_pos = cursor.tell()
+        self.end_pos = self.start_pos
 
         if self.has_length(8):
-            self.magic_num = uint4(self.blockchain)
-            self.block_size = uint4(self.blockchain)
+            self.magic_num = cursor.uint4()
+            self.block_size = cursor.uint4()
         else:
             self.is_ready = False
             return
+        if self.magic_num not in NETWORK_MAGICS:
+            # Not a block, e.g. the zero padding of a preallocated file.
+            self.is_ready = False
+            return
 
         if self.has_length(self.block_size):
             self.set_header()
-            self.tx_count = varint(self.blockchain)
-            self.txs = []
+            self.tx_count = cursor.varint()
         else:
             self.is_ready = False
-        self.tx_pos = self.blockchain.tell()
-        
-        # Parse all the TX in the block here.
+        self.tx_pos = cursor.tell()
+        if not self.is_ready:
+            return
+
+        self.end_pos = self.start_pos + 8 + self.block_size
+        self._txs = None
+        if not lazy:
+            # Parse all the TX in the block here.
+            self._txs = list(self.iter_txs())
+        cursor.seek(self.end_pos)
+
+    @property
+    def txs(self):
+        if self._txs is None:
+            self._txs = list(self.iter_txs())
+        return self._txs
+
+    @txs.setter
+    def txs(self, txs):
+        self._txs = txs
+
+    def iter_txs(self):
+        """ Yields the transactions, decoding them one by one if not parsed yet. """
+        if self._txs is not None:
+            yield from self._txs
+            return
+        cursor = Cursor(self.blockchain.buf, self.tx_pos)
         for i in range(0, self.tx_count):
-            tx = Tx(self.blockchain)
-            self.txs.append(tx)
+            yield Tx(cursor)
+
+    def __iter__(self):
+        return self.iter_txs()
 
     def get_block_size(self):
         return self.block_size
 
+    def verify_merkle(self):
+        """ Whether the merkle root of the transactions matches the header. """
+        root = merkle_root([tx.tx_hash_raw for tx in self.iter_txs()])
+        return root[::-1] == self.block_header.merkle_hash
+
     def is_ready(self):
         return self.is_ready;
 
     def has_length(self, size):
-        cur_pos = self.blockchain.tell()
-        self.blockchain.seek(0, 2)
-        total_file_size = self.blockchain.tell()
-        self.blockchain.seek(cur_pos)
-
-        if total_file_size - cur_pos < size:
-            return False
-        else:
-            return True
+        return self.blockchain.remaining() >= size
 
     def set_header(self):
         self.block_header = BlockHeader(self.blockchain)
@@ -109,55 +389,111 @@ class Block:
 
 
 class Tx:
-    def __init__(self, blockchain):
-        start_pos = blockchain.tell()
-        self.version = uint4(blockchain)
-        check_pos = blockchain.tell()
+    def __init__(self, cursor):
+        buf = cursor.buf
+        start_pos = cursor.pos
+        self.version = unpack_uint4(buf, start_pos)[0]
+        check_pos = start_pos + 4
 
         # Segwit - https://en.bitcoin.it/wiki/Transaction
         # BIP141 - https://github.com/bitcoin/bips/blob/master/bip-0141.mediawiki#specification
-        tx_in_pos = blockchain.tell()
-        marker = uint1(blockchain)
-        flag = uint1(blockchain)
+        tx_in_pos = check_pos
+        marker = buf[check_pos]
+        flag = buf[check_pos + 1]
         # The data structure is a little bit different after the segwit.
         is_segwit = False
-        if marker != 0 or flag != 1:
-            blockchain.seek(check_pos)
-        else:
+        if marker == 0 and flag == 1:
             is_segwit = True
-            tx_in_pos = blockchain.tell()
+            tx_in_pos = check_pos + 2
 
-        self.inCount = varint(blockchain)
+        self.inCount, cursor.pos = read_varint(buf, tx_in_pos)
         self.inputs = []
         self.seq = 1
         for i in range(0, self.inCount):
-            self.inputs.append(TxInput(blockchain, i))
-        self.outCount = varint(blockchain)
+            self.inputs.append(TxInput(cursor, i))
+        self.outCount, cursor.pos = read_varint(buf, cursor.pos)
         self.outputs = []
         if self.outCount > 0:
             for i in range(0, self.outCount):
-                self.outputs.append(TxOutput(blockchain, i))
-        segwit_pos = blockchain.tell()
-        # For segwit
+                self.outputs.append(TxOutput(cursor, i))
+        segwit_pos = pos = cursor.pos
+        # For segwit, only remember where each input's witness starts and
+        # skip over it, TxInput.witness decodes it when asked for.
         if is_segwit:
-            for i in range(0, self.inCount):
-                num_op = varint(blockchain)
+            for tx_input in self.inputs:
+                tx_input.witness_pos = pos
+                num_op, pos = read_varint(buf, pos)
                 for n in range(0, num_op):
-                    op_code = varint(blockchain)
-                    _ = hashStr(blockchain.read(op_code))
-        raw_lock_time = blockchain.read(4)
-        self.lock_time = struct.unpack('I', raw_lock_time)[0]
-        cur_pos = blockchain.tell()
-        blockchain.seek(start_pos)
-        if is_segwit:
-            raw_version = blockchain.read(4)
-            blockchain.read(2)
-            raw_in_out = blockchain.read(segwit_pos - tx_in_pos)
-            self.raw_bytes = raw_version + raw_in_out + raw_lock_time
+                    op_code, pos = read_varint(buf, pos)
+                    pos += op_code
+        self.lock_time = unpack_uint4(buf, pos)[0]
+        cursor.pos = pos + 4
+
+        # Where the tx is in buf, so that nothing has to be copied out of it.
+        self.buf = buf
+        self.is_segwit = is_segwit
+        self.start_pos = start_pos
+        self.end_pos = pos + 4
+        self.tx_in_pos = tx_in_pos
+        self.segwit_pos = segwit_pos
+
+    @cached_property
+    def tx_hash_raw(self):
+        """ The txid digest in wire byte order, tx_hash is the usual reversed hex. """
+        buf = self.buf
+        if self.is_segwit:
+            # The txid skips the marker, flag and witness data, feed the
+            # parts to the hash instead of joining them.
+            sha = hashlib.sha256(buf[self.start_pos:self.start_pos + 4])
+            sha.update(buf[self.tx_in_pos:self.segwit_pos])
+            sha.update(buf[self.end_pos - 4:self.end_pos])
         else:
-            self.raw_bytes = blockchain.read(cur_pos - start_pos)
-        blockchain.seek(cur_pos)
-        self.tx_hash = hash_tx(self.raw_bytes)
+            sha = hashlib.sha256(buf[self.start_pos:self.end_pos])
+        return hashlib.sha256(sha.digest()).digest()
+
+    @property
+    def raw_bytes(self):
+        """ The serialization the txid is computed from, without witness. """
+        buf = self.buf
+        if self.is_segwit:
+            return b''.join((buf[self.start_pos:self.start_pos + 4],
+                             buf[self.tx_in_pos:self.segwit_pos],
+                             buf[self.end_pos - 4:self.end_pos]))
+        return buf[self.start_pos:self.end_pos]
+
+    @cached_property
+    def wtxid_raw(self):
+        """ Hash of the full serialization, witness included (BIP141). """
+        if not self.is_segwit:
+            return self.tx_hash_raw
+        return sha256d(self.buf[self.start_pos:self.end_pos])
+
+    @cached_property
+    def wtxid(self):
+        return self.wtxid_raw[::-1].hex()
+
+    @property
+    def size(self):
+        """ Serialized size in bytes, witness included. """
+        return self.end_pos - self.start_pos
+
+    @property
+    def weight(self):
+        # BIP141: 3 * size without witness + size with witness.
+        size = self.end_pos - self.start_pos
+        if not self.is_segwit:
+            return 4 * size
+        # marker + flag and the witness section run from segwit_pos to the lock time.
+        stripped_size = size - 2 - (self.end_pos - 4 - self.segwit_pos)
+        return 3 * stripped_size + size
+
+    @property
+    def vsize(self):
+        return (self.weight + 3) // 4
+
+    @cached_property
+    def tx_hash(self):
+        return self.tx_hash_raw[::-1].hex()
 
     def to_string(self):
         sb = []
@@ -176,19 +512,54 @@ class Tx:
 
 
 class TxInput:
-    def __init__(self, blockchain, idx):
+    def __init__(self, cursor, idx):
+        buf = cursor.buf
+        pos = cursor.pos
         self.idx = idx
-        self.prev_hash = hashStr(hash32(blockchain))
-        self.tx_outId = uint4(blockchain)
-        self.script_len = varint(blockchain)
-        self.script_raw = blockchain.read(self.script_len)
-        self.seqNo = uint4(blockchain)
+        # Wire byte order, prev_hash is the usual reversed hex.
+        self.prev_hash_raw = buf[pos:pos + 32]
+        self.tx_outId = unpack_uint4(buf, pos + 32)[0]
+        self.script_len, pos = read_varint(buf, pos + 36)
+        self.script_raw = buf[pos:pos + self.script_len]
+        pos += self.script_len
+        self.seqNo = unpack_uint4(buf, pos)[0]
+        cursor.pos = pos + 4
+        self.buf = buf
+        # Offset of the witness stack in buf, set by Tx for segwit txs.
+        self.witness_pos = None
+
+    @cached_property
+    def witness(self):
+        """ The witness stack items as memoryview slices, [] without witness. """
+        if self.witness_pos is None:
+            return []
+        buf = self.buf
+        num_items, pos = read_varint(buf, self.witness_pos)
+        items = []
+        for n in range(0, num_items):
+            item_len, pos = read_varint(buf, pos)
+            items.append(buf[pos:pos + item_len])
+            pos += item_len
+        return items
+
+    @cached_property
+    def prev_hash(self):
+        return self.prev_hash_raw.tobytes()[::-1].hex()
+
+    @cached_property
+    def hex_str(self):
+        return self.script_raw.hex()
+
+    @cached_property
+    def segments(self):
         # coinbase's script is arbitary.
         if 0xffffffff == self.tx_outId:  # Coinbase
-            self.segments = hashStr(self.script_raw)
-        else:
-            self.segments = segment(self.script_raw)
-        self.decode_script_sig(self.script_raw)
+            return self.hex_str
+        return segment(self.script_raw)
+
+    @cached_property
+    def pub_key(self):
+        return self.decode_script_sig(self.script_raw)
 
     def to_string(self):
         sb = []
@@ -200,27 +571,23 @@ class TxInput:
         return sb
 
     def decode_script_sig(self, script_raw:bytes):
-        """ Custom logic here. """
+        """ Custom logic here. Returns the pub_key of the scriptSig. """
         sb = []
-        self.hex_str = hashStr(script_raw)
         # segwit
         if len(self.hex_str) == 0:
-            self.pub_key = ""
-            return
+            return ""
         if 0xffffffff == self.tx_outId:  # Coinbase
-            self.pub_key = str(bytes.fromhex(self.hex_str))
-            return
+            return str(bytes.fromhex(self.hex_str))
         script_len = int(self.hex_str[0:2], 16)
         script_len *= 2
         script = self.hex_str[2:2 + script_len]
         sb.append("  Script: " + script)
         try:
             if SIGHASH_ALL != int(self.hex_str[script_len:script_len + 2], 16):  # should be 0x01
-                self.pub_key = ""
-            else:
-                self.pub_key = self.hex_str[2 + script_len + 2:2 + script_len + 2 + 66]
+                return ""
+            return self.hex_str[2 + script_len + 2:2 + script_len + 2 + 66]
         except:
-            self.pub_key = ""
+            return ""
 
     def decode_out_idx(self, idx):
         sb = []
@@ -233,14 +600,54 @@ class TxInput:
 
 class TxOutput:
     """ Handle specific output in the transaction. """
-    def __init__(self, blockchain, idx):
+    def __init__(self, cursor, idx):
+        buf = cursor.buf
+        pos = cursor.pos
         self.idx = idx
-        self.value = uint8(blockchain)
-        self.script_len = varint(blockchain)
-        self.script_raw = blockchain.read(self.script_len)
-        self.addr = "UNKNOWN"
-        self.segments = segment(self.script_raw)
-        self.decode_script_sig(self.script_raw)
+        self.value = unpack_uint8(buf, pos)[0]
+        self.script_len, pos = read_varint(buf, pos + 8)
+        self.script_raw = buf[pos:pos + self.script_len]
+        cursor.pos = pos + self.script_len
+
+    @cached_property
+    def hex_str(self):
+        return self.script_raw.hex()
+
+    @cached_property
+    def segments(self):
+        return segment(self.script_raw)
+
+    @cached_property
+    def _classified(self):
+        return classify_script(self.script_raw)
+
+    @cached_property
+    def script_type(self):
+        """ SCRIPT_* template code of the script. """
+        return self._classified[0]
+
+    @cached_property
+    def payload(self):
+        """ The slice of the script the template identifies, e.g. the pubkey hash. """
+        return self._classified[1]
+
+    @cached_property
+    def type(self):
+        return SCRIPT_TYPE_NAMES[self.script_type]
+
+    @cached_property
+    def addr(self):
+        return script_address(self.script_type, self.payload)
+
+    @cached_property
+    def pubkey_human(self):
+        """
+        The script as opcode names and hex pushes, e.g. "OP_DUP OP_HASH160
+        <hash> OP_EQUALVERIFY OP_CHECKSIG", for every template. It used to
+        be a per-template text such as "OP_RETURN <data>" or
+        "PUSH_DATA:<data>", set only for some of them.
+        """
+        return ' '.join(op.hex() if isinstance(op, bytes) else op for op in self.segments)
 
     def to_string(self):
         sb = []
@@ -252,68 +659,6 @@ class TxOutput:
 
     def decode_script_sig(self, script_raw:bytes):
         ''' Custom analysis logic here. '''
-        hexstr = hashStr(script_raw)
-        self.hex_str = hexstr
-        # Get the first two bytes.
-        # which might some problem.
-        # https://www.blockchain.com/btc/tx/7bd54def72825008b4ca0f4aeff13e6be2c5fe0f23430629a9d484a1ac2a29b8
-        try:
-            op_idx = int(hexstr[0:2], 16)
-        except:
-            self.type = "EXCEPTION"
-            self.addr = "UNKNOWN"
-            return
-        try:
-            op_code = OPCODE_NAMES[op_idx]
-        except KeyError:
-            if op_idx == 65:
-                self.type = "P2PK"
-                # Obsoleted pay to pubkey directly
-                # For detail see: https://en.bitcoin.it/wiki/Script#Obsolete_pay-to-pubkey_transaction
-                pub_key_len = op_idx
-                op_code_tail = OPCODE_NAMES[int(hexstr[2 + pub_key_len * 2:2 + pub_key_len * 2 + 2], 16)]
-                self.pubkey_human = "Pubkey OP_CODE: None Bytes:%s tail_op_code:%s %d" % (
-                pub_key_len, op_code_tail, op_idx)
-                self.addr = pubkey_to_address(hexstr[2:2 + pub_key_len * 2])[0]
-            else:
-                # Some times people will push data directly
-                # e.g: https://www.blockchain.com/btc/tx/d65bb24f6289dad27f0f7e75e80e187d9b189a82dcf5a86fb1c6f8ff2b2c190f
-                self.type = "UN"
-                pub_key_len = op_idx
-                self.pubkey_human = "PUSH_DATA:%s" % hexstr[2:2 + pub_key_len * 2]
-                self.addr = "UNKNOWN"
-            return
-        try:
-            if op_code == "OP_DUP":
-                self.type = "P2PKHA"
-                # P2PKHA pay to pubkey hash mode
-                # For detail see: https://en.bitcoin.it/wiki/Script#Standard_Transaction_to_Bitcoin_address_.28pay-to-pubkey-hash.29
-                op_code2 = OPCODE_NAMES[int(hexstr[2:4], 16)]
-                pub_key_len = int(hexstr[4:6], 16)
-                op_code_tail2 = OPCODE_NAMES[int(hexstr[6 + pub_key_len * 2:6 + pub_key_len * 2 + 2], 16)]
-                op_code_tail_last = OPCODE_NAMES[int(hexstr[6 + pub_key_len * 2 + 2:6 + pub_key_len * 2 + 4], 16)]
-                self.pubkey_human = "%s %s %s %s %s" % (
-                op_code, op_code2, hexstr[6:6 + pub_key_len * 2], op_code_tail2, op_code_tail_last)
-                self.addr = gen_addr(hexstr[6:6 + pub_key_len * 2])[0]
-            elif op_code == "OP_HASH160":
-                self.type = "P2SH"
-                # P2SHA pay to script hash
-                # https://en.bitcoin.it/wiki/Transaction#Pay-to-Script-Hash
-                pub_key_len = int(hexstr[2:4], 16)
-                op_code_tail = OPCODE_NAMES[int(hexstr[4 + pub_key_len * 2:4 + pub_key_len * 2 + 2], 16)]
-                hash_code = hexstr[4:4 + pub_key_len * 2]
-                self.pubkey_human = "%s %s %s" % (op_code, hash_code, op_code_tail)
-                self.addr = hash_code
-            elif op_code == "OP_RETURN":
-                self.type = "OP_RETURN"
-                pub_key_len = int(hexstr[2:4], 16)
-                hash_code = hexstr[4:4 + pub_key_len * 2]
-                self.pubkey_human = "OP_RETURN %s" % (hash_code)
-                self.addr = hash_code
-            else:  # TODO extend for multi-signature parsing
-                self.type = "UN"
-                self.pubkey_human = "Need to extend multi-signaturer parsing %x" % int(hexstr[0:2], 16) + op_code
-                self.addr = "UNKNOWN"
-        except:
-            self.type = "ERROR"
-            self.addr = "UNKNOWN"
+        self.script_type, self.payload = classify_script(script_raw)
+        self.type = SCRIPT_TYPE_NAMES[self.script_type]
+        self.addr = script_address(self.script_type, self.payload)
@@ -0,0 +1,197 @@
+import heapq
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+from crypto_lib import find_block, sha256d, unpack_header
+
+# block hash, previous hash, offset of the magic number, block size, time
+# The hashes use the same byte order as BlockHeader.previous_hash.
+INDEX_RECORD = struct.Struct('<32s32sQII')
+INDEX_MAGIC = b'BLKIDX01'
+
+# The hash-sorted section: a header with the number of records it covers,
+# then block hash and record number per record, in hash order.
+HASH_RECORD = struct.Struct('<32sI')
+HASH_MAGIC = b'BLKHSH01'
+_HASH_HEADER = struct.Struct('<8sQ')
+
+_BLOCK_PREFIX = struct.Struct('<II')
+
+IndexEntry = namedtuple('IndexEntry', ['block_hash', 'previous_hash', 'offset', 'size', 'time'])
+
+
+class BlockIndex:
+    """
+    Sidecar index of a blk file with one fixed-width record per block, in
+    file order. The index file is memory-mapped for lookups and new blocks
+    are appended by update(), so a growing blk file is only walked from
+    the last indexed block on.
+
+    find() binary searches index_filename + '.hashes', the records sorted
+    by hash, also memory-mapped. The new records are merged into it after
+    an update and it is rebuilt when missing.
+    """
+    def __init__(self, index_filename):
+        self.index_filename = index_filename
+        self.hashes_filename = index_filename + '.hashes'
+        self.index = None
+        self.hashes = None
+        if not os.path.exists(index_filename) or os.path.getsize(index_filename) < len(INDEX_MAGIC):
+            self.reset()
+        self.open()
+
+    def open(self):
+        if self.index is not None:
+            self.index.close()
+        with open(self.index_filename, 'rb') as f:
+            self.index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.index[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            self.index.close()
+            self.index = None
+            raise ValueError("%s is not a block index" % self.index_filename)
+        self.count = (len(self.index) - len(INDEX_MAGIC)) // INDEX_RECORD.size
+        self._open_hashes()
+
+    def _map_hashes(self):
+        """ The mapped hash section and the record count it covers, (None, 0) if there is no valid one. """
+        try:
+            with open(self.hashes_filename, 'rb') as f:
+                hashes = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # ValueError: an empty file cannot be mapped.
+            return None, 0
+        if len(hashes) >= _HASH_HEADER.size:
+            magic, count = _HASH_HEADER.unpack_from(hashes)
+            if (magic == HASH_MAGIC and count <= self.count
+                    and len(hashes) == _HASH_HEADER.size + count * HASH_RECORD.size):
+                return hashes, count
+        hashes.close()
+        return None, 0
+
+    def _open_hashes(self):
+        """ Maps the hash section, merging in the records it does not cover yet. """
+        if self.hashes is not None:
+            self.hashes.close()
+        hashes, count = self._map_hashes()
+        if count < self.count:
+            # The records added since, sorted; the ones already there are streamed from the map.
+            record_size = INDEX_RECORD.size
+            base = len(INDEX_MAGIC)
+            new = sorted(HASH_RECORD.pack(self.index[base + i * record_size:base + i * record_size + 32], i)
+                         for i in range(count, self.count))
+            old = (hashes[pos:pos + HASH_RECORD.size]
+                   for pos in range(_HASH_HEADER.size, _HASH_HEADER.size + count * HASH_RECORD.size,
+                                    HASH_RECORD.size))
+            tmp_filename = self.hashes_filename + '.tmp'
+            with open(tmp_filename, 'wb', buffering=1 << 20) as f:
+                f.write(_HASH_HEADER.pack(HASH_MAGIC, self.count))
+                for record in heapq.merge(old, new):
+                    f.write(record)
+            if hashes is not None:
+                hashes.close()
+            os.replace(tmp_filename, self.hashes_filename)
+            hashes, count = self._map_hashes()
+        self.hashes = hashes
+
+    def reset(self):
+        with open(self.index_filename, 'wb') as f:
+            f.write(INDEX_MAGIC)
+        if os.path.exists(self.hashes_filename):
+            os.remove(self.hashes_filename)
+        self.count = 0
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        if self.hashes is not None:
+            self.hashes.close()
+            self.hashes = None
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("block index out of range")
+        return IndexEntry._make(INDEX_RECORD.unpack_from(self.index, len(INDEX_MAGIC) + i * INDEX_RECORD.size))
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def indexed_end(self):
+        """ File offset right after the last indexed block. """
+        if self.count == 0:
+            return 0
+        last = self[-1]
+        return last.offset + 8 + last.size
+
+    def update(self, blockchain):
+        """
+        Indexes the complete blocks of blockchain (the blk file buffer) past
+        the last indexed one. Returns the number of blocks added.
+        """
+        def blocks(pos):
+            while True:
+                pos = find_block(blockchain, pos)
+                if pos is None:
+                    return
+                block_size = _BLOCK_PREFIX.unpack_from(blockchain, pos)[1]
+                yield pos, block_size, blockchain[pos + 8:pos + 88]
+                pos += 8 + block_size
+
+        return self.add_blocks(len(blockchain), blocks)
+
+    def add_blocks(self, size, blocks):
+        """
+        update() for a blk file of size bytes that is not one buffer, e.g.
+        an obfuscated one: blocks(pos) yields (offset, block size, header)
+        for its complete blocks from pos on.
+        """
+        pos = self.indexed_end()
+        if pos > size:
+            # The blk file was replaced by a shorter one, start over.
+            self.close()
+            self.reset()
+            pos = 0
+        records = []
+        for pos, block_size, header in blocks(pos):
+            _, previous_hash, _, time, _, _ = unpack_header(header)
+            records.append(INDEX_RECORD.pack(sha256d(header)[::-1], previous_hash[::-1], pos, block_size, time))
+        if records:
+            with open(self.index_filename, 'r+b') as f:
+                # Drop a torn record left by an interrupted update.
+                f.truncate(len(INDEX_MAGIC) + self.count * INDEX_RECORD.size)
+                f.seek(0, 2)
+                f.write(b''.join(records))
+        self.open()
+        return len(records)
+
+    def find(self, block_hash):
+        """ Returns the IndexEntry of block_hash (hex string or bytes), or None. """
+        if isinstance(block_hash, str):
+            block_hash = bytes.fromhex(block_hash)
+        block_hash = bytes(block_hash)
+        hashes = self.hashes
+        if hashes is None:
+            return None
+        record_size = HASH_RECORD.size
+        base = _HASH_HEADER.size
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = base + mid * record_size
+            if hashes[pos:pos + 32] < block_hash:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self.count:
+            return None
+        found, i = HASH_RECORD.unpack_from(hashes, base + lo * record_size)
+        return self[i] if found == block_hash else None
@@ -0,0 +1,206 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import parallel
+from block import BlockFile, OutputFilter
+from block_index import BlockIndex
+from crypto_op import SCRIPT_OP_RETURN
+from crypto_lib import merkle_root, sha256d, xor_bytes
+
+def tx_count(block):
+    return block.tx_count
+
+class TestBlockFile(unittest.TestCase):
+
+    def test_lazy_blocks_match_eager(self):
+        eager = list(BlockFile("1M.dat").get_next_block())
+        lazy = list(BlockFile("1M.dat", lazy=True).get_next_block())
+        self.assertEqual(len(eager), 4522)
+        self.assertEqual(len(lazy), len(eager))
+        for e, l in zip(eager[:200], lazy[:200]):
+            self.assertEqual((e.start_pos, e.end_pos, e.tx_count), (l.start_pos, l.end_pos, l.tx_count))
+            self.assertEqual([tx.tx_hash for tx in e.txs], [tx.tx_hash for tx in l])
+
+    def test_segwit_block(self):
+        blocks = list(BlockFile("blk01234.001", lazy=True).get_next_block())
+        self.assertEqual(len(blocks), 1)
+        txs = blocks[0].txs
+        self.assertEqual(len(txs), blocks[0].tx_count)
+        self.assertEqual(txs[0].tx_hash, "886723399667ca1591161b6e355f1c7c5aada0a229bd30a02cc6269b877d68d1")
+        self.assertEqual(txs[1].tx_hash, "697af18a115485a0ca683cc2b86f42f8e764cc1e81d8fe2ce297722f332ae9ed")
+        segwit = [tx for tx in txs if tx.is_segwit]
+        self.assertTrue(segwit)
+        for tx in segwit:
+            self.assertEqual(sha256d(tx.raw_bytes), tx.tx_hash_raw)
+            self.assertNotEqual(tx.wtxid_raw, tx.tx_hash_raw)
+            self.assertEqual(tx.wtxid_raw, sha256d(tx.buf[tx.start_pos:tx.end_pos]))
+            self.assertLess(tx.vsize, tx.size)
+            self.assertEqual(tx.weight, 3 * len(tx.raw_bytes) + tx.size)
+            self.assertTrue(tx.inputs[0].witness)
+        # The coinbase witness is the 32-byte witness reserved value.
+        self.assertEqual([bytes(item) for item in txs[0].inputs[0].witness], [b"\0" * 32])
+        self.assertEqual((txs[0].size, txs[0].weight, txs[0].vsize), (277, 1000, 250))
+        self.assertEqual(txs[1].inputs[0].witness, [])
+        self.assertEqual(txs[1].weight, 4 * txs[1].size)
+
+    def test_input_pub_key(self):
+        txs = BlockFile("1M.dat", lazy=True).get_block_at(BlockFile("1M.dat").get_block_offsets()[170]).txs
+        self.assertEqual(txs[0].inputs[0].pub_key, str(b"\x04\xff\xff\x00\x1d\x01\x02"))
+        self.assertEqual(txs[1].inputs[0].pub_key, "")
+        with self.assertRaises(AttributeError):
+            txs[1].inputs[0].pub_kye
+
+    def test_index_lookup(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            index_filename = os.path.join(tmp, "1M.dat.idx")
+            block_file = BlockFile("1M.dat", lazy=True)
+            index = block_file.get_index(index_filename)
+            self.assertEqual(len(index), 4522)
+            self.assertEqual(index[0].block_hash.hex(),
+                             "000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f")
+            entry = index[1234]
+            block = block_file.get_block_by_hash(entry.block_hash.hex())
+            self.assertEqual(block.start_pos, entry.offset)
+            self.assertEqual(block.block_header.previous_hash, index[1233].block_hash)
+            self.assertIsNone(index.find(b"\0" * 32))
+            # Reopening appends nothing, the file is already indexed.
+            index.close()
+            self.assertEqual(BlockIndex(index_filename).update(block_file.blockchain), 0)
+
+    def test_index_grows(self):
+        with open("1M.dat", "rb") as f:
+            data = f.read()
+        offsets = BlockFile("1M.dat").get_block_offsets()
+        with tempfile.TemporaryDirectory() as tmp:
+            index = BlockIndex(os.path.join(tmp, "blk.idx"))
+            self.assertEqual(index.update(data[:offsets[1000]]), 1000)
+            self.assertEqual(index.update(data), len(offsets) - 1000)
+            # The hash section covers the old and the new records, in hash order.
+            hashes = sorted(entry.block_hash for entry in index)
+            self.assertEqual([index.find(block_hash).block_hash for block_hash in hashes], hashes)
+            self.assertEqual(index.find(index[3000].block_hash).offset, offsets[3000])
+            index.close()
+            # A missing hash section is rebuilt.
+            os.remove(os.path.join(tmp, "blk.idx.hashes"))
+            index = BlockIndex(os.path.join(tmp, "blk.idx"))
+            self.assertEqual(index.find(index[10].block_hash).offset, offsets[10])
+            index.close()
+
+    def test_merkle_root(self):
+        a, b, c = (sha256d(bytes([i])) for i in range(3))
+        self.assertEqual(merkle_root([a]), a)
+        self.assertEqual(merkle_root([a, b, c]), sha256d(sha256d(a + b) + sha256d(c + c)))
+
+    def test_verify_merkle(self):
+        self.assertEqual(BlockFile("blk01234.001").verify_merkle(), [])
+        with open("1M.dat", "rb") as f:
+            data = bytearray(f.read())
+        offsets = BlockFile("1M.dat").get_block_offsets()
+        # Flip a byte of the coinbase of block 100, past its 88 bytes of prefix and header.
+        data[offsets[100] + 8 + 80 + 10] ^= 0xff
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "blk00000.dat")
+            with open(filename, "wb") as f:
+                f.write(data)
+            self.assertEqual(BlockFile(filename).verify_merkle(), [offsets[100]])
+            self.assertEqual(BlockFile(filename).verify_merkle(workers=2), [offsets[100]])
+
+    def test_resync(self):
+        with open("1M.dat", "rb") as f:
+            data = f.read()
+        offsets = BlockFile("1M.dat").get_block_offsets()
+        garbage = bytes(range(256)) * 4
+        torn = data[offsets[50]:offsets[50] + 100]
+        # Garbage after block 9, a torn copy of block 50 before block 50, zero padding at the end.
+        damaged = (data[:offsets[10]] + garbage + data[offsets[10]:offsets[50]] + torn
+                   + data[offsets[50]:offsets[100]] + b"\0" * 100000)
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "blk00000.dat")
+            with open(filename, "wb") as f:
+                f.write(damaged)
+            block_file = BlockFile(filename, lazy=True)
+            garbage_end = offsets[10] + len(garbage)
+            torn_start = garbage_end + offsets[50] - offsets[10]
+            expected_skips = [(offsets[10], garbage_end), (torn_start, torn_start + len(torn)),
+                              (len(damaged) - 100000, len(damaged))]
+            found = block_file.get_block_offsets()
+            self.assertEqual(len(found), 100)
+            self.assertEqual(block_file.skipped, expected_skips)
+            hashes = [block.block_header.block_hash for block in block_file.get_next_block()]
+            self.assertEqual(hashes, [BlockFile("1M.dat").get_block_at(offset).block_header.block_hash
+                                      for offset in offsets[:100]])
+            self.assertEqual(block_file.skipped, expected_skips)
+            self.assertEqual(len(block_file.get_index(os.path.join(tmp, "blk00000.dat.idx"))), 100)
+            # Obfuscated, through windows much smaller than the file.
+            key = bytes.fromhex("a1b2c3d4e5f60718")
+            xor_filename = os.path.join(tmp, "obfuscated.dat")
+            with open(xor_filename, "wb") as f:
+                f.write(xor_bytes(damaged, key))
+            with mock.patch("block.XOR_WINDOW", 4096), mock.patch("block.MAX_BLOCK_SIZE", 1000):
+                xor_file = BlockFile(xor_filename, lazy=True, xor_key=key)
+                self.assertEqual(xor_file.get_block_offsets(), found)
+                self.assertEqual(xor_file.skipped, expected_skips)
+                self.assertEqual([block.block_header.block_hash for block in xor_file.get_next_block()], hashes)
+
+    def test_xor_obfuscated(self):
+        key = bytes.fromhex("a1b2c3d4e5f60718")
+        with open("1M.dat", "rb") as f:
+            data = f.read()
+        plain = [block.block_header.block_hash for block in BlockFile("1M.dat", lazy=True).get_next_block()]
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, "xor.dat"), "wb") as f:
+                f.write(key)
+            filename = os.path.join(tmp, "blk00000.dat")
+            with open(filename, "wb") as f:
+                f.write(xor_bytes(data, key))
+            block_file = BlockFile(filename, lazy=True)
+            self.assertEqual(block_file.xor_key, key)
+            self.assertEqual([block.block_header.block_hash for block in block_file.get_next_block()], plain)
+            self.assertEqual(block_file.verify_merkle(), [])
+            follower = block_file.follow(idle_timeout=0.1)
+            self.assertEqual([block.block_header.block_hash for block in follower], plain)
+            follower.close()
+        self.assertEqual(xor_bytes(xor_bytes(data[:1001], key, 3), key, 3), data[:1001])
+
+    def test_xor_key_given(self):
+        key = bytes.fromhex("0102030405060708")
+        with open("1M.dat", "rb") as f:
+            data = f.read()
+        plain_file = BlockFile("1M.dat", lazy=True)
+        offsets = plain_file.get_block_offsets()
+        with tempfile.TemporaryDirectory() as tmp:
+            # No xor.dat next to it, the key is only passed in.
+            filename = os.path.join(tmp, "obfuscated.dat")
+            with open(filename, "wb") as f:
+                f.write(xor_bytes(data, key))
+            block_file = BlockFile(filename, lazy=True, xor_key=key)
+            self.assertEqual(block_file.get_block_offsets(), offsets)
+            self.assertEqual(block_file.get_block_at(offsets[300]).block_header.block_hash,
+                             plain_file.get_block_at(offsets[300]).block_header.block_hash)
+            self.assertEqual(block_file.verify_merkle(workers=2), [])
+            self.assertEqual(parallel.scan_block_file(filename, tx_count, xor_key=key),
+                             parallel.scan_block_file("1M.dat", tx_count))
+            index = block_file.get_index(os.path.join(tmp, "obfuscated.idx"))
+            self.assertEqual([entry.offset for entry in index], offsets)
+            self.assertEqual(block_file.export_columns(os.path.join(tmp, "export")),
+                             plain_file.export_columns(os.path.join(tmp, "export_plain")))
+
+    def test_iter_blocks_filters(self):
+        block_file = BlockFile("1M.dat", lazy=True)
+        numbers = [number for number, block in block_file.iter_blocks(100, 110)]
+        self.assertEqual(numbers, list(range(100, 110)))
+        blocks = list(block_file.iter_blocks(min_time=1231731025, max_time=1231731025))
+        self.assertEqual([(number, block.tx_count) for number, block in blocks], [(170, 2)])
+        # The block 9 coinbase pays the pubkey of a P2PKH address that block 170 then pays.
+        output_filter = OutputFilter(addresses=["12cbQLTFMXRnSzktFkuoG3eHoMeFtpTu3S"])
+        found = [(number, tx.tx_hash[:8], i) for number, block in block_file.iter_blocks(0, 171)
+                 for tx in block for i, tx_output in output_filter.outputs(tx)]
+        self.assertEqual(found, [(9, "0437cd7f", 0), (170, "f4184fc5", 1)])
+        op_return = OutputFilter(script_types=[SCRIPT_OP_RETURN])
+        tx = BlockFile("blk01234.001", lazy=True).get_block_at(0).txs[0]
+        self.assertEqual([i for i, tx_output in op_return.outputs(tx)], [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
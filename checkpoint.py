@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+# Where a scan is: the blk file, the offset just past its last fully
+# processed block, the number of the next block and a digest of the
+# consumer's state at that point.
+Checkpoint = namedtuple('Checkpoint', 'block_filename offset block_count state_digest')
+
+
+def state_digest(state):
+    """ Hex SHA256 of the consumer state bytes, None without state. """
+    if state is None:
+        return None
+    return hashlib.sha256(state).hexdigest()
+
+
+def load_checkpoint(filename):
+    """ The Checkpoint saved in filename, None if there is none yet. """
+    try:
+        with open(filename) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    return Checkpoint(data['block_filename'], data['offset'], data['block_count'], data['state_digest'])
+
+
+def save_checkpoint(filename, checkpoint):
+    """
+    Writes checkpoint to a temporary file next to filename and renames it
+    over filename, so a crash leaves either the old or the new checkpoint.
+    """
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump(checkpoint._asdict(), f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def checkpointed(blocks, checkpoint_filename, interval=5000, state=None, on_save=None):
+    """
+    Passes the (block_filename, number, block) items of blocks through and
+    saves a checkpoint every interval blocks, and once more at the end.
+    A block only counts as processed when the consumer asks for the next
+    one, so the checkpoint never gets ahead of the consumer. state, if
+    given, is called for the consumer state bytes to digest. on_save, if
+    given, is called right before each save, e.g. to flush the consumer's
+    buffered output so that it is on disk up to the checkpoint.
+    """
+    last = None
+    count = 0
+    for item in blocks:
+        yield item
+        last = item
+        count += 1
+        if count % interval == 0:
+            _save(checkpoint_filename, last, state, on_save)
+    if last is not None:
+        _save(checkpoint_filename, last, state, on_save)
+
+
+def _save(checkpoint_filename, item, state, on_save):
+    if on_save is not None:
+        on_save()
+    block_filename, number, block = item
+    save_checkpoint(checkpoint_filename, Checkpoint(block_filename, block.end_pos, number + 1,
+                                                    state_digest(state() if state is not None else None)))
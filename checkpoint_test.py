@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+from block import BlockFile
+from checkpoint import Checkpoint, checkpointed, load_checkpoint, save_checkpoint, state_digest
+
+class TestCheckpoint(unittest.TestCase):
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "scan.checkpoint")
+            self.assertIsNone(load_checkpoint(filename))
+            checkpoint = Checkpoint("blk00000.dat", 1234, 5, state_digest(b"state"))
+            save_checkpoint(filename, checkpoint)
+            self.assertEqual(load_checkpoint(filename), checkpoint)
+            self.assertEqual(os.listdir(tmp), ["scan.checkpoint"])
+
+    def test_checkpointed_resume(self):
+        block_file = BlockFile("1M.dat", lazy=True)
+        items = (("1M.dat", number, block) for number, block in block_file.iter_blocks())
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "scan.checkpoint")
+            seen = []
+            blocks = checkpointed(items, filename, interval=100, state=lambda: str(len(seen)).encode())
+            for _, number, block in blocks:
+                if number == 250:
+                    break
+                seen.append(number)
+            # Block 250 was handed out but not processed, the last checkpoint is after block 199.
+            checkpoint = load_checkpoint(filename)
+            self.assertEqual(checkpoint.block_count, 200)
+            self.assertEqual(checkpoint.state_digest, state_digest(b"200"))
+            number, block = next(block_file.iter_blocks(offset=checkpoint.offset))
+            self.assertEqual(number, 0)
+            self.assertEqual(block.start_pos, block_file.get_block_offsets()[200])
+
+    def test_output_flushed_before_save(self):
+        block_file = BlockFile("1M.dat", lazy=True)
+        items = (("1M.dat", number, block) for number, block in block_file.iter_blocks())
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "scan.checkpoint")
+            out_filename = os.path.join(tmp, "out.txt")
+            with open(out_filename, 'wb', buffering=1 << 20) as out:
+                for _, number, block in checkpointed(items, filename, interval=100, on_save=out.flush):
+                    if number == 250:
+                        # As if killed here: only what reached the file counts.
+                        with open(out_filename, 'rb') as f:
+                            written = f.read().splitlines()
+                        break
+                    out.write(b"%d\n" % number)
+            checkpoint = load_checkpoint(filename)
+            self.assertEqual(checkpoint.block_count, 200)
+            self.assertGreaterEqual(len(written), checkpoint.block_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,12 +2,157 @@
 # https://en.bitcoin.it/wiki/Protocol_documentation#Addresses
 
 import hashlib
-import base58
+import os
 import struct
+import base58check
+import bech32
 import ripemd
+from collections import OrderedDict
 
 from crypto_op import *
 
+_UINT2 = struct.Struct('<H')
+_UINT4 = struct.Struct('<I')
+_UINT8 = struct.Struct('<Q')
+
+# unpack_from(buffer, offset) -> (value,) for the hot parsing loops.
+unpack_uint2 = _UINT2.unpack_from
+unpack_uint4 = _UINT4.unpack_from
+unpack_uint8 = _UINT8.unpack_from
+# version, previous hash, merkle root, time, bits, nonce
+unpack_header = struct.Struct('<I32s32sIII').unpack_from
+
+
+def read_varint(buf, pos):
+    """ Decodes the varint at buf[pos], returns (value, next_pos). """
+    size = buf[pos]
+    if size < 0xfd:
+        return size, pos + 1
+    if size == 0xfd:
+        return unpack_uint2(buf, pos + 1)[0], pos + 3
+    if size == 0xfe:
+        return unpack_uint4(buf, pos + 1)[0], pos + 5
+    return unpack_uint8(buf, pos + 1)[0], pos + 9
+
+
+# magic number, block size
+unpack_block_prefix = struct.Struct('<II').unpack_from
+
+NETWORK_MAGIC_BYTES = tuple(_UINT4.pack(magic) for magic in sorted(NETWORK_MAGICS))
+
+
+def is_block_at(buf, pos):
+    """
+    Whether a complete block starts at buf[pos]: a network magic number, a
+    plausible size that fits in buf, and after the block either the end of
+    buf, zero padding or the next magic number. Before damaged bytes, the
+    block still counts if its magic number does not show up again within
+    it, which is where the next block starts when this one is torn.
+    """
+    size = len(buf)
+    if pos + 8 > size:
+        return False
+    magic, block_size = unpack_block_prefix(buf, pos)
+    if magic not in NETWORK_MAGICS or not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+        return False
+    end = pos + 8 + block_size
+    if end > size:
+        return False
+    if end + 4 > size:
+        return True
+    following = unpack_uint4(buf, end)[0]
+    if following == 0 or following in NETWORK_MAGICS:
+        return True
+    return buf.find(buf[pos:pos + 4], pos + 8, end) < 0
+
+
+def find_block(buf, pos, skipped=None, magic=None, limit=None):
+    """
+    Offset of the first complete block at or after pos in buf (an mmap or
+    bytes), None if there is none. Zero padding and damaged bytes are
+    jumped over with buf.find() on the magic number bytes, magic if given,
+    else those of every network. The (start, end) ranges skipped are
+    appended to skipped. With a limit, only blocks starting before it are
+    looked for, e.g. in a window of a file.
+    """
+    size = len(buf)
+    end = size if limit is None else min(limit, size)
+    start = pos
+    patterns = (magic,) if magic is not None else NETWORK_MAGIC_BYTES
+    while pos + 8 <= size and pos < end:
+        if is_block_at(buf, pos):
+            if skipped is not None and pos > start:
+                skipped.append((start, pos))
+            return pos
+        found = [p for p in (buf.find(pattern, pos + 1) for pattern in patterns) if p >= 0]
+        if not found:
+            break
+        pos = min(found)
+    if skipped is not None and start < end:
+        skipped.append((start, end))
+    return None
+
+
+class Cursor:
+    """
+    Decodes the wire format straight out of a buffer (usually the mmap of
+    a blk file) by offset. Fields are read with precompiled structs and
+    unpack_from, so no intermediate bytes object is built per field the
+    way stream.read() does; raw data comes back as memoryview slices.
+    """
+    __slots__ = ('buf', 'pos', 'size')
+
+    def __init__(self, buf, pos=0):
+        self.buf = memoryview(buf)
+        self.pos = pos
+        self.size = len(self.buf)
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos):
+        self.pos = pos
+
+    def remaining(self):
+        return self.size - self.pos
+
+    def uint1(self):
+        pos = self.pos
+        self.pos = pos + 1
+        return self.buf[pos]
+
+    def uint2(self):
+        pos = self.pos
+        self.pos = pos + 2
+        return _UINT2.unpack_from(self.buf, pos)[0]
+
+    def uint4(self):
+        pos = self.pos
+        self.pos = pos + 4
+        return _UINT4.unpack_from(self.buf, pos)[0]
+
+    def uint8(self):
+        pos = self.pos
+        self.pos = pos + 8
+        return _UINT8.unpack_from(self.buf, pos)[0]
+
+    def varint(self):
+        value, self.pos = read_varint(self.buf, self.pos)
+        return value
+
+    def hash32(self):
+        # Same byte order as hash32(stream).
+        pos = self.pos
+        self.pos = pos + 32
+        return self.buf[pos:pos + 32].tobytes()[::-1]
+
+    def read(self, size):
+        """ Returns the next size bytes as a memoryview slice, no copy. """
+        pos = self.pos
+        self.pos = pos + size
+        return self.buf[pos:pos + size]
+
+
 def uint1(stream):
     return ord(stream.read(1))
 
@@ -55,13 +200,82 @@ def varint(stream):
     return -1
 
 
+def sha256d(data):
+    """ Double SHA256 digest, in wire byte order. """
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+
+def read_xor_key(directory):
+    """
+    The obfuscation key of the blk files of a blocks directory (xor.dat),
+    None if there is none or it is all zeros.
+    """
+    try:
+        with open(os.path.join(directory, 'xor.dat'), 'rb') as f:
+            key = f.read()
+    except FileNotFoundError:
+        return None
+    if not key.strip(b'\0'):
+        return None
+    return key
+
+
+def xor_bytes(data, key, offset=0, window=1 << 16):
+    """
+    data XORed with key repeated from file offset offset on, as a new
+    bytearray. The XOR runs on window-sized integers (int.from_bytes), not
+    byte by byte.
+    """
+    size = len(data)
+    out = bytearray(size)
+    key_len = len(key)
+    shift = offset % key_len
+    key = bytes(key[shift:] + key[:shift])
+    window -= window % key_len
+    pattern = int.from_bytes(key * (window // key_len), 'little')
+    from_bytes = int.from_bytes
+    for start in range(0, size - window + 1, window):
+        end = start + window
+        out[start:end] = (from_bytes(data[start:end], 'little') ^ pattern).to_bytes(window, 'little')
+    start = size - size % window
+    if start < size:
+        tail = size - start
+        pattern = from_bytes((key * (tail // key_len + 1))[:tail], 'little')
+        out[start:] = (from_bytes(data[start:], 'little') ^ pattern).to_bytes(tail, 'little')
+    return out
+
+
+def merkle_root(hashes):
+    """
+    Merkle root of the given 32-byte txid digests (wire byte order, as is
+    the result). The tree is computed level by level in place in a single
+    buffer, each pair hashed straight from a memoryview of it.
+    """
+    buf = bytearray(b''.join(hashes))
+    n = len(buf) // 32
+    if n == 0:
+        return bytes(32)
+    # Room for duplicating the last hash of an odd level.
+    buf += bytes(32)
+    view = memoryview(buf)
+    sha256 = hashlib.sha256
+    while n > 1:
+        if n & 1:
+            view[n * 32:n * 32 + 32] = view[n * 32 - 32:n * 32]
+            n += 1
+        for i in range(0, n // 2):
+            view[i * 32:i * 32 + 32] = sha256(sha256(view[i * 64:i * 64 + 64]).digest()).digest()
+        n //= 2
+    return bytes(view[0:32])
+
+
 def hash_tx(tx_bytes):
-    hash_bytes = hashlib.sha256(hashlib.sha256(tx_bytes).digest()).digest()[::-1]
+    hash_bytes = sha256d(tx_bytes)[::-1]
     return hashStr(hash_bytes)
 
 
 def hashStr(bytes):
-    return ''.join(("%02x" % a) for a in bytes)
+    return bytearray(bytes).hex()
 
 
 def convert_hex_to_ascii(h):
@@ -80,26 +294,64 @@ def gen_addr(hash_code):
     https://en.bitcoin.it/wiki/Protocol_documentation#Addresses
     """
     key_hash = '00' + hash_code
-    # Obtain signature:
-    sha = hashlib.sha256()
-    sha.update(bytearray.fromhex(key_hash))
-    checksum = sha.digest()
-    sha = hashlib.sha256()
-    sha.update(checksum)
-    checksum = sha.hexdigest()[0:8]
-    address = (base58.b58encode(bytes(bytearray.fromhex(key_hash + checksum)))).decode('utf-8')
-    return address, key_hash, checksum
+    data = bytes.fromhex(key_hash)
+    checksum = base58check.checksum(data)
+    address = base58check.b58encode(data + checksum)
+    return address, key_hash, checksum.hex()
+
+
+def hash_to_address(hash_bytes, version=b'\x00'):
+    """ Base58Check address of a raw hash160, without the hex round trip of gen_addr(). """
+    return base58check.encode(version + bytes(hash_bytes))
+
+
+def _openssl_ripemd160(data):
+    return hashlib.new('ripemd160', data).digest()
+
+
+def _legacy_ripemd160(data):
+    return ripemd.RIPEMD160(bytes(data)).digest()
+
+
+RIPEMD160_BACKENDS = {
+    'openssl': _openssl_ripemd160,
+    'python': ripemd.ripemd160,
+    'legacy': _legacy_ripemd160,
+}
+
+
+def set_ripemd160_backend(name):
+    """ Selects the RIPEMD160 implementation used by hash160(), see RIPEMD160_BACKENDS. """
+    global ripemd160
+    ripemd160 = RIPEMD160_BACKENDS[name]
+
+
+# hashlib only has ripemd160 when OpenSSL provides it (OpenSSL 3 moved it to
+# the legacy provider), otherwise fall back to the pure Python one.
+try:
+    hashlib.new('ripemd160')
+    set_ripemd160_backend('openssl')
+except ValueError:
+    set_ripemd160_backend('python')
 
 
 def hash160(hex_str):
     """
     See 'compressed form' at https://en.bitcoin.it/wiki/Protocol_documentation#Signatures
     """
-    sha = hashlib.sha256()
-    rip = ripemd.RIPEMD160()
-    sha.update(hex_str)
-    rip.update(sha.digest())
-    return rip.hexdigest()  # .hexdigest() is hex ASCII
+    return ripemd160(hashlib.sha256(hex_str).digest()).hex()
+
+
+def hash160_digest(data):
+    """ hash160() as raw bytes. """
+    return ripemd160(hashlib.sha256(data).digest())
+
+
+def hash160_many(items):
+    """ hash160() of each of items, as a list. """
+    sha256 = hashlib.sha256
+    rmd = ripemd160
+    return [rmd(sha256(item).digest()).hex() for item in items]
 
 
 def pubkey_to_address(pubkey):
@@ -118,33 +370,247 @@ def pubkey_to_address(pubkey):
     return gen_addr(hash160(hex_str))
 
 
-def segment(raw_script):
-    """ Segments the hex script to op sequence. """
-    hex_script = hashStr(raw_script)
+class AddressCache:
+    """
+    Bounded LRU memo of derived addresses, keyed by bytes (version byte +
+    pubkey or hash). Keeps hit/miss/eviction counters, and the hottest
+    entries can be saved to a table on disk and loaded by other scans.
+    """
+    _LENGTH = struct.Struct('<B')
+
+    def __init__(self, capacity=1 << 16):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, derive):
+        """ The address of key, calling derive(key) on a miss. """
+        entries = self.entries
+        addr = entries.get(key)
+        if addr is not None:
+            entries.move_to_end(key)
+            self.hits += 1
+            return addr
+        self.misses += 1
+        addr = entries[key] = derive(key)
+        if len(entries) > self.capacity:
+            entries.popitem(last=False)
+            self.evictions += 1
+        return addr
+
+    def resize(self, capacity):
+        self.capacity = capacity
+        while len(self.entries) > capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return {'size': len(self.entries), 'capacity': self.capacity, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+    def save(self, filename, count=None):
+        """ Writes the count most recently used entries (all by default) to filename. """
+        pack = self._LENGTH.pack
+        items = list(self.entries.items())
+        if count is not None:
+            items = items[len(items) - count:] if count else []
+        with open(filename, 'wb') as f:
+            for key, addr in items:
+                addr = addr.encode('ascii')
+                f.write(pack(len(key)) + key + pack(len(addr)) + addr)
+
+    def load(self, filename):
+        """ Adds the entries of a table written by save(), returns how many. """
+        with open(filename, 'rb') as f:
+            data = f.read()
+        pos = 0
+        count = 0
+        while pos < len(data):
+            key_len = data[pos]
+            key = data[pos + 1:pos + 1 + key_len]
+            pos += 1 + key_len
+            addr_len = data[pos]
+            self.entries[key] = data[pos + 1:pos + 1 + addr_len].decode('ascii')
+            self.entries.move_to_end(key)
+            pos += 1 + addr_len
+            count += 1
+        self.resize(self.capacity)
+        return count
+
+
+address_cache = AddressCache()
+
+
+def _derive_hash_addr(key):
+    # The key already is the version byte + hash.
+    return base58check.encode(key)
+
+
+def _derive_pubkey_addr(key):
+    return base58check.encode(key[:1] + hash160_digest(key[1:]))
+
+
+def _derive_segwit_addr(key):
+    return bech32.encode('bc', key[0] & 0x7f, key[1:])
+
+
+def cached_gen_addr(hash_bytes):
+    """ gen_addr(hash_bytes.hex())[0] through address_cache. """
+    return address_cache.get(b'\x00' + bytes(hash_bytes), _derive_hash_addr)
+
+
+def cached_pubkey_to_address(pubkey):
+    """ pubkey_to_address(pubkey.hex())[0] through address_cache. """
+    return address_cache.get(b'\x00' + bytes(pubkey), _derive_pubkey_addr)
+
+
+def classify_script(script):
+    """
+    Matches an output script against the standard templates by length and
+    fixed bytes. Returns (script type, payload) where payload is a slice of
+    script: the pubkey, the hash or witness program, the pubkey pushes of
+    a multisig, the first push after OP_RETURN, or the whole script when
+    nonstandard.
+    """
+    n = len(script)
+    if n == 25:
+        if (script[0] == OP_DUP and script[1] == OP_HASH160 and script[2] == 20
+                and script[23] == OP_EQUALVERIFY and script[24] == OP_CHECKSIG):
+            return SCRIPT_P2PKH, script[3:23]
+    elif n == 23:
+        if script[0] == OP_HASH160 and script[1] == 20 and script[22] == OP_EQUAL:
+            return SCRIPT_P2SH, script[2:22]
+    elif n == 22:
+        if script[0] == OP_0 and script[1] == 20:
+            return SCRIPT_P2WPKH, script[2:22]
+    elif n == 34:
+        if script[1] == 32:
+            if script[0] == OP_0:
+                return SCRIPT_P2WSH, script[2:34]
+            if script[0] == OP_1:
+                return SCRIPT_P2TR, script[2:34]
+    elif n == 35:
+        if script[0] == 33 and script[34] == OP_CHECKSIG and script[1] in (2, 3):
+            return SCRIPT_P2PK, script[1:34]
+    elif n == 67:
+        if script[0] == 65 and script[66] == OP_CHECKSIG and script[1] in (4, 6, 7):
+            return SCRIPT_P2PK, script[1:66]
+    if n == 0:
+        return SCRIPT_NONSTANDARD, script
+    if script[0] == OP_RETURN:
+        for op, data in iter_script(script[1:]):
+            return SCRIPT_OP_RETURN, data if data is not None else script[1:1]
+        return SCRIPT_OP_RETURN, script[1:1]
+    if (n >= 37 and script[n - 1] == OP_CHECKMULTISIG
+            and OP_1 <= script[0] <= OP_16 and OP_1 <= script[n - 2] <= OP_16):
+        # m <pubkey>... n OP_CHECKMULTISIG with n pubkeys of 33 or 65 bytes.
+        pos = 1
+        keys = 0
+        while pos < n - 2 and script[pos] in (33, 65):
+            pos += 1 + script[pos]
+            keys += 1
+        if pos == n - 2 and keys == script[n - 2] - OP_1 + 1 and script[0] <= script[n - 2]:
+            return SCRIPT_MULTISIG, script[1:n - 2]
+    return SCRIPT_NONSTANDARD, script
+
+
+def script_address(script_type, payload):
+    """ The address of a classified output script, "UNKNOWN" if it has none. """
+    if script_type == SCRIPT_P2PKH:
+        return address_cache.get(b'\x00' + bytes(payload), _derive_hash_addr)
+    if script_type == SCRIPT_P2WPKH or script_type == SCRIPT_P2WSH:
+        return address_cache.get(b'\x80' + bytes(payload), _derive_segwit_addr)
+    if script_type == SCRIPT_P2TR:
+        return address_cache.get(b'\x81' + bytes(payload), _derive_segwit_addr)
+    if script_type == SCRIPT_P2SH:
+        return address_cache.get(b'\x05' + bytes(payload), _derive_hash_addr)
+    if script_type == SCRIPT_P2PK:
+        return address_cache.get(b'\x00' + bytes(payload), _derive_pubkey_addr)
+    if script_type == SCRIPT_OP_RETURN:
+        return payload.hex()
+    return "UNKNOWN"
+
+
+def address_to_script(addr):
+    """
+    The output script paying a mainnet P2PKH, P2SH or segwit address, the
+    inverse of script_address(). ValueError for anything else.
+    """
+    if addr[:3].lower() == 'bc1':
+        witver, witprog = bech32.decode('bc', addr)
+        return bytes([OP_1 + witver - 1 if witver else OP_0, len(witprog)]) + witprog
+    data = base58check.decode(addr)
+    if len(data) == 21 and data[0] == 0:
+        return bytes([OP_DUP, OP_HASH160, 20]) + data[1:] + bytes([OP_EQUALVERIFY, OP_CHECKSIG])
+    if len(data) == 21 and data[0] == 5:
+        return bytes([OP_HASH160, 20]) + data[1:] + bytes([OP_EQUAL])
+    raise ValueError("not a P2PKH or P2SH address: %r" % addr)
+
+
+# Opcode dispatch for iter_script(): how many little-endian length bytes
+# follow a push opcode (0 for 0x01-0x4b, the opcode is the length), or
+# None for opcodes that push no data.
+_PUSH_LENGTH_SIZE = [None] * 256
+for _op in range(1, OP_PUSHDATA1):
+    _PUSH_LENGTH_SIZE[_op] = 0
+_PUSH_LENGTH_SIZE[OP_PUSHDATA1] = 1
+_PUSH_LENGTH_SIZE[OP_PUSHDATA2] = 2
+_PUSH_LENGTH_SIZE[OP_PUSHDATA4] = 4
+
+_SEGMENT_NAMES = [OPCODE_NAMES.get(_op) or "ERROR:{}-{:02x}".format(_op, _op) for _op in range(256)]
+
+
+def iter_script(raw_script):
+    """
+    Tokenizes raw script bytes lazily. Yields (opcode, data) pairs where
+    data is a memoryview of the pushed bytes for push opcodes and None
+    otherwise. A push running past the end of the script gets the bytes
+    that are there.
+    """
+    script = memoryview(raw_script)
+    end = len(script)
+    length_sizes = _PUSH_LENGTH_SIZE
     pos = 0
+    while pos < end:
+        op = script[pos]
+        pos += 1
+        length_size = length_sizes[op]
+        if length_size is None:
+            yield op, None
+            continue
+        if length_size == 0:
+            data_len = op
+        else:
+            data_len = int.from_bytes(script[pos:pos + length_size], 'little')
+            pos += length_size
+        yield op, script[pos:pos + data_len]
+        pos += data_len
+
+
+def segment(raw_script):
+    """ Segments the script to op sequence, see iter_script(). """
+    # reference
+    # https://github.com/bitcoin-sv/bitcoin-sv/blob/v1.0.10/src/script/interpreter.cpp#L310-L337
+    names = _SEGMENT_NAMES
     op_list = []
-    push_data_dict = {OP_PUSHDATA1:2, OP_PUSHDATA2:4, OP_PUSHDATA4:8}
-    while pos < len(hex_script):
-        hex_idx = hex_script[pos:pos+2]
-        op_idx = int(hex_script[pos:pos+2], 16)
-        pos+=2
-        # reference
-        # https://github.com/bitcoin-sv/bitcoin-sv/blob/v1.0.10/src/script/interpreter.cpp#L310-L337
-        if op_idx in OPCODE_NAMES:
-            op_list.append(OPCODE_NAMES[op_idx])
-            # If the op is PUSHDATAX, read the following payload.
-            if op_idx in push_data_dict:
-                data_len = int(hex_script[pos:pos+push_data_dict[op_idx]], 16)
-                op_list.append(bytes.fromhex(hex_script[pos:pos+data_len * 2]))
-                pos += data_len * 2
-            if op_idx == OP_1NEGATE:
+    for op, data in iter_script(raw_script):
+        if data is None:
+            op_list.append(names[op])
+            if op == OP_1NEGATE:
                 op_list.append("-1")
-                pos += 2
-        elif op_idx <= 75:  # The data should less than 150.
-            op_list.append(hex_script[pos:pos+op_idx*2])
-            pos+=op_idx*2
+        elif op < OP_PUSHDATA1:
+            op_list.append(data.hex())
         else:
-            error = "ERROR:{}-{}".format(op_idx, hex_idx)
-            op_list.append(error)
+            # PUSHDATAX, the name followed by the payload.
+            op_list.append(names[op])
+            op_list.append(data.tobytes())
     return op_list
-            
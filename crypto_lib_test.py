@@ -1,3 +1,5 @@
+import os
+import tempfile
 import unittest
 import crypto_lib
 
@@ -25,6 +27,56 @@ class TestStringMethods(unittest.TestCase):
         )
 
 
+    def test_cursor_reads_fields(self):
+        cursor = crypto_lib.Cursor(bytes.fromhex(
+            "01000000" "fd0302" "fe04030201" "0807060504030201" "aabb"))
+        self.assertEqual(cursor.uint4(), 1)
+        self.assertEqual(cursor.varint(), 0x0203)
+        self.assertEqual(cursor.varint(), 0x01020304)
+        self.assertEqual(cursor.uint8(), 0x0102030405060708)
+        self.assertEqual(bytes(cursor.read(2)), b"\xaa\xbb")
+        self.assertEqual(cursor.remaining(), 0)
+
+    def test_segment_pushdata(self):
+        # PUSHDATA lengths are little-endian and not part of the payload.
+        self.assertEqual(
+            crypto_lib.segment(bytes.fromhex("004c03aabbcc4d0100dd4f87")),
+            ['OP_0', 'OP_PUSHDATA1', b'\xaa\xbb\xcc', 'OP_PUSHDATA2', b'\xdd', 'OP_1NEGATE', '-1', 'OP_EQUAL']
+        )
+        self.assertEqual(crypto_lib.segment(b"\xba"), ['ERROR:186-ba'])
+
+    def test_iter_script(self):
+        tokens = [(op, data if data is None else bytes(data))
+                  for op, data in crypto_lib.iter_script(bytes.fromhex("a914" + "11" * 20 + "87" + "4e0500000001"))]
+        self.assertEqual(tokens, [(0xa9, None), (0x14, b"\x11" * 20), (0x87, None), (0x4e, b"\x01")])
+
+    def test_classify_script(self):
+        h20 = "11" * 20
+        h32 = "22" * 32
+        pubkey = "02" + "33" * 32
+        cases = [
+            ("76a914" + h20 + "88ac", crypto_lib.SCRIPT_P2PKH, h20, "12ZEw5Hcv1hTb6YUQJ69y1V7uhcoDz92PH"),
+            ("a914" + h20 + "87", crypto_lib.SCRIPT_P2SH, h20, "33FFrcn4Tv1qgGEuXPkkPdr44DuWp3RzPo"),
+            ("0014" + h20, crypto_lib.SCRIPT_P2WPKH, h20, "bc1qzyg3zyg3zyg3zyg3zyg3zyg3zyg3zyg3h8ffkz"),
+            ("0020" + h32, crypto_lib.SCRIPT_P2WSH, h32, None),
+            ("5120" + h32, crypto_lib.SCRIPT_P2TR, h32, None),
+            ("21" + pubkey + "ac", crypto_lib.SCRIPT_P2PK, pubkey, None),
+            ("5121" + pubkey + "21" + pubkey + "52ae", crypto_lib.SCRIPT_MULTISIG, "21" + pubkey + "21" + pubkey, "UNKNOWN"),
+            ("6a04deadbeef", crypto_lib.SCRIPT_OP_RETURN, "deadbeef", "deadbeef"),
+            ("5121" + pubkey + "53ae", crypto_lib.SCRIPT_NONSTANDARD, "5121" + pubkey + "53ae", "UNKNOWN"),
+        ]
+        for script, script_type, payload, addr in cases:
+            found_type, found_payload = crypto_lib.classify_script(memoryview(bytes.fromhex(script)))
+            self.assertEqual((found_type, found_payload.hex()), (script_type, payload), script)
+            if addr is not None:
+                self.assertEqual(crypto_lib.script_address(found_type, found_payload), addr)
+                if found_type != crypto_lib.SCRIPT_OP_RETURN and addr != "UNKNOWN":
+                    self.assertEqual(crypto_lib.address_to_script(addr).hex(), script)
+        taproot = crypto_lib.script_address(crypto_lib.SCRIPT_P2TR, bytes.fromhex(h32))
+        self.assertTrue(taproot.startswith("bc1p"))
+        self.assertEqual(crypto_lib.address_to_script(taproot).hex(), "5120" + h32)
+        self.assertRaises(ValueError, crypto_lib.address_to_script, "1abc")
+
     def test_pubkey_to_address(self):
         # Genesis 
         # 04678afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6bc3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5f
@@ -35,6 +87,29 @@ class TestStringMethods(unittest.TestCase):
         self.assertEqual(hash_key.upper(), "0062E907B15CBF27D5425399EBF6F0FB50EBB88F18")
         self.assertEqual(check_sum.upper(), "C29B7D93")
 
+    def test_address_cache(self):
+        cache = crypto_lib.AddressCache(capacity=2)
+        derive = lambda key: key.hex()
+        self.assertEqual(cache.get(b"a", derive), "61")
+        cache.get(b"b", derive)
+        cache.get(b"a", derive)
+        cache.get(b"c", derive)  # evicts b, the least recently used
+        self.assertEqual(list(cache.entries), [b"a", b"c"])
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (1, 3, 1))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "addr.tbl")
+            cache.save(filename, count=1)
+            other = crypto_lib.AddressCache()
+            self.assertEqual(other.load(filename), 1)
+            self.assertEqual(other.get(b"c", None), "63")
+
+    def test_cached_pubkey_to_address(self):
+        pubkey = bytes.fromhex("04678afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6bc3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5f")
+        self.assertEqual(crypto_lib.cached_pubkey_to_address(pubkey), "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa")
+        self.assertEqual(crypto_lib.cached_gen_addr(bytes.fromhex("62e907b15cbf27d5425399ebf6f0fb50ebb88f18")),
+                         "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa")
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
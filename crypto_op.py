@@ -11,6 +11,43 @@ TX_PUBKEYHASH  = 'pubkey-hash'
 TX_SCRIPTHASH  = 'script-hash'
 TX_MULTISIG    = 'multi-sig'
 
+# Block magic numbers, as read little-endian from the blk files.
+MAGIC_MAINNET  = 0xd9b4bef9
+MAGIC_TESTNET3 = 0x0709110b
+MAGIC_TESTNET4 = 0x283f161c
+MAGIC_SIGNET   = 0x40cf030a
+MAGIC_REGTEST  = 0xdab5bffa
+NETWORK_MAGICS = frozenset((MAGIC_MAINNET, MAGIC_TESTNET3, MAGIC_TESTNET4, MAGIC_SIGNET, MAGIC_REGTEST))
+
+# Serialized block size limit (BIP141 weight limit / 1), and the smallest
+# block: a header and the tx count.
+MAX_BLOCK_SIZE = 4000000
+MIN_BLOCK_SIZE = 81
+
+# Output script templates, as returned by crypto_lib.classify_script().
+SCRIPT_NONSTANDARD = 0
+SCRIPT_P2PK        = 1
+SCRIPT_P2PKH       = 2
+SCRIPT_P2SH        = 3
+SCRIPT_P2WPKH      = 4
+SCRIPT_P2WSH       = 5
+SCRIPT_P2TR        = 6
+SCRIPT_MULTISIG    = 7
+SCRIPT_OP_RETURN   = 8
+
+# TxOutput.type of each template.
+SCRIPT_TYPE_NAMES = {
+    SCRIPT_NONSTANDARD : 'UN',
+    SCRIPT_P2PK : 'P2PK',
+    SCRIPT_P2PKH : 'P2PKHA',
+    SCRIPT_P2SH : 'P2SH',
+    SCRIPT_P2WPKH : 'P2WPKH',
+    SCRIPT_P2WSH : 'P2WSH',
+    SCRIPT_P2TR : 'P2TR',
+    SCRIPT_MULTISIG : 'MULTISIG',
+    SCRIPT_OP_RETURN : 'OP_RETURN',
+}
+
 # ===----------------------------------------------------------------------===
 
 # push value
@@ -0,0 +1,146 @@
+import os
+import sys
+from array import array
+
+# Columns of each table: name -> array typecode, 'H32' for 32-byte hashes.
+# Txids are in wire byte order and block hashes in the order of
+# BlockHeader.block_hash/previous_hash, so that equal values join.
+TABLES = {
+    'blocks': (('offset', 'Q'), ('size', 'I'), ('block_hash', 'H32'), ('previous_hash', 'H32'),
+               ('version', 'I'), ('time', 'I'), ('bits', 'I'), ('nonce', 'I'), ('tx_count', 'I')),
+    'txs': (('block', 'Q'), ('txid', 'H32'), ('version', 'I'), ('lock_time', 'I'), ('is_segwit', 'B'),
+            ('input_count', 'I'), ('output_count', 'I'), ('size', 'I'), ('vsize', 'I')),
+    'inputs': (('tx', 'Q'), ('prev_txid', 'H32'), ('prev_vout', 'I'), ('sequence', 'I')),
+    'outputs': (('tx', 'Q'), ('vout', 'I'), ('value', 'Q'), ('script_type', 'B')),
+}
+
+_DESCR = {'B': '|u1', 'I': '<u4', 'Q': '<u8'}
+
+
+def write_npy(filename, typecode, data, width=None):
+    """
+    Writes an array (or, for width, a bytearray of rows of width bytes) as
+    a NumPy .npy version 1.0 file, so that numpy.load(filename, mmap_mode='r')
+    maps it without NumPy being needed here.
+    """
+    if width is None:
+        if typecode != 'B' and sys.byteorder == 'big':
+            data = array(typecode, data)
+            data.byteswap()
+        shape = (len(data),)
+        descr = _DESCR[typecode]
+    else:
+        shape = (len(data) // width, width)
+        descr = '|u1'
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': %r, }" % (descr, shape)
+    # The magic, version, header length and header take a multiple of 64 bytes.
+    header += ' ' * (63 - (10 + len(header)) % 64) + '\n'
+    with open(filename, 'wb') as f:
+        f.write(b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header.encode('latin1'))
+        f.write(data)
+
+
+class _Table:
+    """ The columns of one table for the current batch. """
+    def __init__(self, name, scripts=False):
+        self.name = name
+        self.columns = {}
+        for column, typecode in TABLES[name]:
+            self.columns[column] = bytearray() if typecode == 'H32' else array(typecode)
+        # Variable length scripts: script_data[script_offsets[i]:script_offsets[i + 1]].
+        self.scripts = scripts
+        if scripts:
+            self.script_offsets = array('Q', [0])
+            self.script_data = bytearray()
+
+    def add_script(self, script):
+        self.script_data += script
+        self.script_offsets.append(len(self.script_data))
+
+    def write(self, directory, batch):
+        path = os.path.join(directory, self.name)
+        os.makedirs(path, exist_ok=True)
+        suffix = '-%06d.npy' % batch
+        for column, typecode in TABLES[self.name]:
+            data = self.columns[column]
+            if typecode == 'H32':
+                write_npy(os.path.join(path, column + suffix), 'B', data, 32)
+            else:
+                write_npy(os.path.join(path, column + suffix), typecode, data)
+        if self.scripts:
+            write_npy(os.path.join(path, 'script_offsets' + suffix), 'Q', self.script_offsets)
+            write_npy(os.path.join(path, 'script_data' + suffix), 'B', self.script_data)
+
+
+def export_blocks(blocks, directory, batch_blocks=10000):
+    """
+    Writes the blocks, txs, inputs and outputs tables of blocks as columns,
+    one .npy file per column and batch: directory/<table>/<column>-<batch>.npy.
+    A batch holds batch_blocks blocks with all their txs, inputs and
+    outputs. The tx and block columns are row numbers in the txs and
+    blocks tables, counted over all the batches. The input and output
+    scripts go to script_data, row i spanning
+    script_data[script_offsets[i]:script_offsets[i + 1]] of its batch.
+
+    Returns the number of rows written per table.
+    """
+    counts = dict.fromkeys(TABLES, 0)
+    batch = 0
+    tables = None
+    for block in blocks:
+        if tables is None:
+            tables = {'blocks': _Table('blocks'), 'txs': _Table('txs'),
+                      'inputs': _Table('inputs', True), 'outputs': _Table('outputs', True)}
+            b = tables['blocks'].columns
+            t = tables['txs'].columns
+            i = tables['inputs'].columns
+            o = tables['outputs'].columns
+            inputs = tables['inputs']
+            outputs = tables['outputs']
+        header = block.block_header
+        block_row = counts['blocks']
+        b['offset'].append(block.start_pos)
+        b['size'].append(block.block_size)
+        b['block_hash'] += header.block_hash
+        b['previous_hash'] += header.previous_hash
+        b['version'].append(header.version)
+        b['time'].append(header.time)
+        b['bits'].append(header.bits)
+        b['nonce'].append(header.nonce)
+        b['tx_count'].append(block.tx_count)
+        counts['blocks'] += 1
+        for tx in block:
+            tx_row = counts['txs']
+            t['block'].append(block_row)
+            t['txid'] += tx.tx_hash_raw
+            t['version'].append(tx.version)
+            t['lock_time'].append(tx.lock_time)
+            t['is_segwit'].append(tx.is_segwit)
+            t['input_count'].append(tx.inCount)
+            t['output_count'].append(tx.outCount)
+            t['size'].append(tx.size)
+            t['vsize'].append(tx.vsize)
+            counts['txs'] += 1
+            for tx_input in tx.inputs:
+                i['tx'].append(tx_row)
+                i['prev_txid'] += tx_input.prev_hash_raw
+                i['prev_vout'].append(tx_input.tx_outId)
+                i['sequence'].append(tx_input.seqNo)
+                inputs.add_script(tx_input.script_raw)
+            for vout, tx_output in enumerate(tx.outputs):
+                o['tx'].append(tx_row)
+                o['vout'].append(vout)
+                o['value'].append(tx_output.value)
+                o['script_type'].append(tx_output.script_type)
+                outputs.add_script(tx_output.script_raw)
+            counts['inputs'] += tx.inCount
+            counts['outputs'] += tx.outCount
+        if len(b['offset']) >= batch_blocks:
+            for table in tables.values():
+                table.write(directory, batch)
+            batch += 1
+            tables = None
+    if tables is not None:
+        for table in tables.values():
+            table.write(directory, batch)
+    return counts
@@ -0,0 +1,47 @@
+import ast
+import glob
+import os
+import tempfile
+import unittest
+from array import array
+from block import BlockFile
+
+def read_npy(filename):
+    """ (descr, shape, raw data) of a .npy file. """
+    with open(filename, "rb") as f:
+        data = f.read()
+    assert data[:8] == b"\x93NUMPY\x01\x00"
+    header_len = int.from_bytes(data[8:10], "little")
+    assert (10 + header_len) % 64 == 0
+    header = ast.literal_eval(data[10:10 + header_len].decode("latin1"))
+    return header["descr"], header["shape"], data[10 + header_len:]
+
+class TestExport(unittest.TestCase):
+
+    def test_export_columns(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            counts = BlockFile("1M.dat").export_columns(tmp, batch_blocks=2000)
+            self.assertEqual(counts["blocks"], 4522)
+            self.assertEqual(len(glob.glob(os.path.join(tmp, "blocks", "time-*.npy"))), 3)
+            descr, shape, data = read_npy(os.path.join(tmp, "txs", "txid-000000.npy"))
+            self.assertEqual((descr, shape[1]), ("|u1", 32))
+            self.assertEqual(data[:32][::-1].hex(),
+                             "4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b")
+            rows = 0
+            for batch in range(3):
+                descr, shape, data = read_npy(os.path.join(tmp, "outputs", "value-%06d.npy" % batch))
+                self.assertEqual(descr, "<u8")
+                values = array("Q", data)
+                self.assertEqual(len(values), shape[0])
+                _, _, offsets = read_npy(os.path.join(tmp, "outputs", "script_offsets-%06d.npy" % batch))
+                _, (script_size,), _ = read_npy(os.path.join(tmp, "outputs", "script_data-%06d.npy" % batch))
+                offsets = array("Q", offsets)
+                self.assertEqual(len(offsets), shape[0] + 1)
+                self.assertEqual(offsets[-1], script_size)
+                rows += shape[0]
+            self.assertEqual(rows, counts["outputs"])
+            self.assertEqual(values[-1], 5000000000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+import ctypes
+import mmap
+import os
+import re
+import select
+import struct
+import time
+
+from block import Block, Tx
+from crypto_lib import Cursor, is_block_at, read_xor_key, unpack_block_prefix, xor_bytes
+from crypto_op import MAX_BLOCK_SIZE, NETWORK_MAGICS
+
+_IN_MODIFY = 0x002
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+
+
+def _inotify_watch(directory):
+    """ A non-blocking inotify fd watching directory for writes and new files, None where unavailable. """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(directory), _IN_MODIFY | _IN_CREATE | _IN_MOVED_TO) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _is_complete(block):
+    """
+    Whether the node is done writing block: its txs decode to exactly its
+    end and hash to the merkle root of its header. The prefix of a block
+    is written before the body, which may still be zeros, or half of it.
+    """
+    cursor = Cursor(block.blockchain.buf[:block.end_pos], block.tx_pos)
+    try:
+        txs = [Tx(cursor) for _ in range(block.tx_count)]
+    except (IndexError, ValueError, struct.error):
+        return False
+    if cursor.tell() != block.end_pos:
+        return False
+    block.txs = txs
+    return block.verify_merkle()
+
+
+def next_block_filename(block_filename):
+    """ blk00041.dat -> blk00042.dat, None if the name has no number. """
+    directory, name = os.path.split(block_filename)
+    match = re.match(r'(.*?)(\d+)(\.dat)$', name)
+    if match is None:
+        return None
+    prefix, number, suffix = match.groups()
+    return os.path.join(directory, '%s%0*d%s' % (prefix, len(number), int(number) + 1, suffix))
+
+
+class BlockFollower:
+    """
+    Tails a growing blk file: yields each complete block once, then waits
+    for the file to grow and moves on to the next blk file when it shows
+    up. The wait is on inotify where available, else the file is polled
+    every poll_interval seconds.
+
+    Only the part of the file from the last complete block on is mapped
+    again after it grew. A block is complete once its txs fill it exactly
+    and match its merkle root, so zero preallocated space and a block
+    being written are waited on. That check decodes the txs, so the
+    blocks come with them whatever lazy says. The blocks have file offsets in start_pos
+    and end_pos; block_filename and offset tell where the next block is.
+
+    Obfuscated files (xor.dat, or xor_key) are mapped the same way and
+    only the next block is decoded, at a wake up where its raw bytes or
+    the file size changed, so idling over preallocated space costs no
+    decoding.
+
+    Iteration stops after idle_timeout seconds without a new block (never
+    by default) or once stop() is called.
+    """
+    def __init__(self, block_filename, offset=0, lazy=True, poll_interval=0.25, idle_timeout=None,
+                 xor_key=None):
+        self.block_filename = block_filename
+        self.offset = offset
+        self.lazy = lazy
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.stopped = False
+        self.file = None
+        self.buf = None
+        self.base = 0
+        # Obfuscated only: (file size, offset, raw bytes) last decoded at offset.
+        self.decoded = None
+        directory = os.path.dirname(os.path.abspath(block_filename))
+        if xor_key is None:
+            xor_key = read_xor_key(directory)
+        self.xor_key = xor_key if xor_key and xor_key.strip(b'\0') else None
+        self.watch_fd = _inotify_watch(directory)
+
+    def stop(self):
+        self.stopped = True
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.buf = None
+        if self.watch_fd is not None:
+            os.close(self.watch_fd)
+            self.watch_fd = None
+
+    def _remap(self):
+        """ Maps the file from the page holding offset up to its current end, if it grew. """
+        if self.file is None:
+            self.file = open(self.block_filename, 'rb')
+            self.buf = None
+        size = os.fstat(self.file.fileno()).st_size
+        base = self.offset - self.offset % mmap.ALLOCATIONGRANULARITY
+        if size <= base:
+            return
+        if self.buf is not None and self.base + len(self.buf) >= size:
+            return
+        self.base = base
+        self.buf = mmap.mmap(self.file.fileno(), size - base, access=mmap.ACCESS_READ, offset=base)
+
+    def _decode(self, pos):
+        """
+        The de-obfuscated block at buf[pos] and the 4 bytes after it (just
+        its prefix if it is no block), None if those raw bytes and the file
+        size are as at the last call.
+        """
+        buf = self.buf
+        size = self.base + len(buf)
+        if self.decoded is not None:
+            last_size, last_offset, last_raw = self.decoded
+            if (last_size, last_offset) == (size, self.offset) and buf[pos:pos + len(last_raw)] == last_raw:
+                return None
+        raw = buf[pos:pos + 8]
+        if len(raw) == 8:
+            magic, block_size = unpack_block_prefix(xor_bytes(raw, self.xor_key, self.offset), 0)
+            if magic in NETWORK_MAGICS and block_size <= MAX_BLOCK_SIZE:
+                raw = buf[pos:pos + 8 + block_size + 4]
+        self.decoded = (size, self.offset, raw)
+        return xor_bytes(raw, self.xor_key, self.offset)
+
+    def _read_blocks(self):
+        buf = self.buf
+        if buf is None:
+            return
+        while True:
+            pos = self.offset - self.base
+            if self.xor_key is not None:
+                block_buf = self._decode(pos)
+                if block_buf is None:
+                    return
+                pos = 0
+            else:
+                block_buf = buf
+            if not is_block_at(block_buf, pos):
+                return
+            try:
+                block = Block(Cursor(block_buf, pos), self.lazy)
+            except (IndexError, ValueError, struct.error):
+                return
+            if not _is_complete(block):
+                # Read again at the next wake up.
+                return
+            block.start_pos += self.offset - pos
+            block.end_pos += self.offset - pos
+            self.offset = block.end_pos
+            yield block
+
+    def _wait(self, timeout):
+        if self.watch_fd is None:
+            time.sleep(min(self.poll_interval, timeout))
+            return
+        if select.select([self.watch_fd], [], [], min(1.0, timeout))[0]:
+            try:
+                while os.read(self.watch_fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def __iter__(self):
+        last_block = time.monotonic()
+        while not self.stopped:
+            self._remap()
+            found = False
+            for block in self._read_blocks():
+                found = True
+                yield block
+                if self.stopped:
+                    return
+            if found:
+                last_block = time.monotonic()
+                continue
+            next_filename = next_block_filename(self.block_filename)
+            if next_filename is not None and os.path.exists(next_filename):
+                # The node moved on, so the blocks of this file are all written.
+                self._remap()
+                yield from self._read_blocks()
+                self.file.close()
+                self.file = None
+                self.block_filename = next_filename
+                self.offset = 0
+                self.base = 0
+                self.decoded = None
+                continue
+            timeout = float('inf')
+            if self.idle_timeout is not None:
+                timeout = self.idle_timeout - (time.monotonic() - last_block)
+                if timeout <= 0:
+                    return
+            self._wait(timeout)
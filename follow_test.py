@@ -0,0 +1,130 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from block import BlockFile
+from crypto_lib import xor_bytes
+from follow import BlockFollower, next_block_filename
+
+class TestFollow(unittest.TestCase):
+
+    def test_next_block_filename(self):
+        self.assertEqual(next_block_filename("/data/blocks/blk00041.dat"), "/data/blocks/blk00042.dat")
+        self.assertIsNone(next_block_filename("1M.dat"))
+
+    def test_follow_growth_and_rollover(self):
+        with open("1M.dat", "rb") as f:
+            data = f.read()
+        offsets = BlockFile("1M.dat").get_block_offsets()
+        with open("blk01234.001", "rb") as f:
+            next_data = f.read()
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "blk00000.dat")
+            # 100 blocks, then preallocated zeros.
+            with open(filename, "wb") as f:
+                f.write(data[:offsets[100]] + b"\0" * 50000)
+
+            def node():
+                time.sleep(0.2)
+                with open(filename, "r+b") as f:
+                    # Into the preallocated space first, then past its end.
+                    f.seek(offsets[100])
+                    f.write(data[offsets[100]:offsets[200]])
+                    f.flush()
+                    time.sleep(0.2)
+                    f.write(data[offsets[200]:offsets[400]])
+                time.sleep(0.2)
+                with open(os.path.join(tmp, "blk00001.dat"), "wb") as f:
+                    f.write(next_data)
+
+            writer = threading.Thread(target=node)
+            writer.start()
+            follower = BlockFile(filename).follow(poll_interval=0.05, idle_timeout=5)
+            starts = []
+            for block in follower:
+                starts.append(block.start_pos)
+                if len(starts) == 401:
+                    follower.stop()
+            follower.close()
+            writer.join()
+            self.assertEqual(starts[:400], offsets[:400])
+            self.assertEqual(starts[400], 0)
+            self.assertEqual(follower.block_filename, os.path.join(tmp, "blk00001.dat"))
+            self.assertEqual(block.txs[0].tx_hash, "886723399667ca1591161b6e355f1c7c5aada0a229bd30a02cc6269b877d68d1")
+
+    def test_block_written_in_two_halves(self):
+        with open("1M.dat", "rb") as f:
+            data = f.read()
+        block_file = BlockFile("1M.dat")
+        offsets = block_file.get_block_offsets()
+        expected = [tx.tx_hash for tx in block_file.get_block_at(offsets[100]).txs]
+        # Past the header and the tx count, into the txs.
+        middle = offsets[100] + 100
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "blk00000.dat")
+            with open(filename, "wb") as f:
+                f.write(data[:offsets[100]] + b"\0" * 50000)
+
+            def node():
+                time.sleep(0.2)
+                with open(filename, "r+b") as f:
+                    f.seek(offsets[100])
+                    f.write(data[offsets[100]:middle])
+                    f.flush()
+                    time.sleep(0.3)
+                    f.write(data[middle:offsets[102]])
+
+            writer = threading.Thread(target=node)
+            writer.start()
+            follower = BlockFile(filename).follow(poll_interval=0.05, idle_timeout=5)
+            blocks = []
+            for block in follower:
+                blocks.append(block)
+                if len(blocks) == 102:
+                    follower.stop()
+            follower.close()
+            writer.join()
+            self.assertEqual([block.start_pos for block in blocks], offsets[:102])
+            self.assertEqual([tx.tx_hash for tx in blocks[100].txs], expected)
+
+    def test_obfuscated_idle(self):
+        key = bytes.fromhex("a1b2c3d4e5f60718")
+        with open("1M.dat", "rb") as f:
+            data = f.read()
+        offsets = BlockFile("1M.dat").get_block_offsets()
+        decoded = []
+
+        def counted_xor_bytes(data, *args):
+            decoded.append(len(data))
+            return xor_bytes(data, *args)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "blk00000.dat")
+            # 100 blocks, then 1 MB of preallocated space.
+            with open(filename, "wb") as f:
+                f.write(xor_bytes(data[:offsets[100]], key) + b"\0" * (1 << 20))
+
+            def node():
+                time.sleep(0.3)
+                with open(filename, "r+b") as f:
+                    f.seek(offsets[100])
+                    f.write(xor_bytes(data[offsets[100]:offsets[102]], key, offsets[100]))
+
+            writer = threading.Thread(target=node)
+            writer.start()
+            # Polled, so it wakes up every 10 ms.
+            with mock.patch("follow._inotify_watch", return_value=None), \
+                    mock.patch("follow.xor_bytes", counted_xor_bytes):
+                follower = BlockFollower(filename, poll_interval=0.01, idle_timeout=0.5, xor_key=key)
+                starts = [block.start_pos for block in follower]
+                follower.close()
+            writer.join()
+            self.assertEqual(starts, offsets[:102])
+            # Each block and its prefix once, a prefix per change seen, never the preallocated tail.
+            self.assertLess(sum(decoded), offsets[102] + 102 * 20 + 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
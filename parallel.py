@@ -0,0 +1,183 @@
+import glob
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from block import BlockFile
+from checkpoint import Checkpoint, load_checkpoint, save_checkpoint, state_digest
+
+# Blk files opened by this (worker) process, by file name.
+_block_files = {}
+
+
+def list_block_files(directory, pattern='blk*.dat'):
+    """ The blk files of a blocks directory, in file order. """
+    return sorted(glob.glob(os.path.join(directory, pattern)))
+
+
+def _fold(blocks, func, reducer, initial):
+    if reducer is None:
+        return [func(block) for block in blocks]
+    acc = initial
+    for block in blocks:
+        acc = reducer(acc, func(block))
+    return acc
+
+
+def scan_block_file(block_filename, func, reducer=None, initial=None, lazy=False, xor_key=None):
+    """
+    Runs func on every block of one blk file. Without a reducer the list of
+    the func results is returned, otherwise they are folded into
+    reducer(reducer(initial, r0), r1)... and only the final value returned.
+    xor_key is passed on to BlockFile.
+    """
+    block_file = BlockFile(block_filename, lazy, xor_key)
+    return _fold(block_file.get_next_block(), func, reducer, initial)
+
+
+def scan_block_range(block_filename, offsets, func, reducer=None, initial=None, lazy=False, xor_key=None):
+    """ Like scan_block_file(), for the blocks at the given offsets only. """
+    block_file = _block_files.get(block_filename)
+    if block_file is None or block_file.lazy != lazy or (xor_key is not None and block_file.xor_key != xor_key):
+        block_file = _block_files[block_filename] = BlockFile(block_filename, lazy, xor_key)
+    return _fold((block_file.get_block_at(offset) for offset in offsets), func, reducer, initial)
+
+
+def _run(executor, jobs, window, ordered):
+    """
+    Submits the (key, fn, args) jobs with at most window of them in flight
+    and yields (key, result), in job order or as they complete.
+    """
+    jobs = iter(jobs)
+
+    def submit():
+        job = next(jobs, None)
+        if job is None:
+            return None
+        key, fn, args = job
+        return executor.submit(fn, *args), key
+
+    if ordered:
+        in_flight = deque()
+        for _ in range(window):
+            job = submit()
+            if job is None:
+                break
+            in_flight.append(job)
+        while in_flight:
+            future, key = in_flight.popleft()
+            result = future.result()
+            job = submit()
+            if job is not None:
+                in_flight.append(job)
+            yield key, result
+    else:
+        in_flight = {}
+        for _ in range(window):
+            job = submit()
+            if job is None:
+                break
+            in_flight[job[0]] = job[1]
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = in_flight.pop(future)
+                job = submit()
+                if job is not None:
+                    in_flight[job[0]] = job[1]
+                yield key, future.result()
+
+
+def scan_directory(directory, func, reducer=None, initial=None, workers=None,
+                   ordered=True, pattern='blk*.dat', lazy=False, checkpoint_filename=None, state=None):
+    """
+    Scans the blk files of directory on a process pool and yields
+    (block_filename, result) per file, where result is what
+    scan_block_file() returns for it. Each worker maps and parses its own
+    files, so only the func/reducer results cross the process boundary:
+    keep them compact. func, reducer and initial must be picklable (e.g.
+    module level functions).
+
+    With ordered=True the results come in file order, otherwise as soon as
+    each file is done. At most 2 * workers files are in flight at a time.
+
+    With checkpoint_filename the scan can be resumed: once the consumer
+    asks for the next result, a Checkpoint of the file just handed out is
+    saved (offset is its size, block_count is not known here and None,
+    state as for checkpoint.checkpointed()), and a scan finding a
+    checkpoint there starts after its file. Needs ordered=True.
+    """
+    if checkpoint_filename is not None and not ordered:
+        raise ValueError("a checkpointed scan needs ordered=True")
+    workers = workers or os.cpu_count() or 1
+    block_filenames = list_block_files(directory, pattern)
+    if checkpoint_filename is not None:
+        block_filenames = _after_checkpoint(block_filenames, load_checkpoint(checkpoint_filename))
+    jobs = ((block_filename, scan_block_file, (block_filename, func, reducer, initial, lazy))
+            for block_filename in block_filenames)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = _run(executor, jobs, 2 * workers, ordered)
+        if checkpoint_filename is None:
+            yield from results
+            return
+        for block_filename, result in results:
+            yield block_filename, result
+            digest = state_digest(state() if state is not None else None)
+            save_checkpoint(checkpoint_filename,
+                            Checkpoint(block_filename, os.path.getsize(block_filename), None, digest))
+
+
+def _after_checkpoint(block_filenames, checkpoint):
+    """ The block_filenames after the file of checkpoint, all of them without one. """
+    if checkpoint is None:
+        return block_filenames
+    names = [os.path.abspath(block_filename) for block_filename in block_filenames]
+    try:
+        return block_filenames[names.index(os.path.abspath(checkpoint.block_filename)) + 1:]
+    except ValueError:
+        raise ValueError("checkpoint file %s is not a scanned blk file" % checkpoint.block_filename)
+
+
+def scan_file(block_filename, func, reducer=None, initial=None, workers=None,
+              chunk_blocks=256, lazy=False, xor_key=None):
+    """
+    Scans a single blk file on a process pool. The block boundaries are
+    found first from the 8-byte block prefixes, then ranges of chunk_blocks
+    blocks are parsed by workers that map the file themselves.
+
+    Yields (first_offset, result) per range in file order, where result is
+    what scan_block_range() returns for it, so the output is the same
+    whatever the number of workers. xor_key is passed on to BlockFile.
+    """
+    workers = workers or os.cpu_count() or 1
+    offsets = BlockFile(block_filename, xor_key=xor_key).get_block_offsets()
+    jobs = ((offsets[i], scan_block_range,
+             (block_filename, offsets[i:i + chunk_blocks], func, reducer, initial, lazy, xor_key))
+            for i in range(0, len(offsets), chunk_blocks))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from _run(executor, jobs, 2 * workers, True)
+
+
+def merkle_mismatch(block):
+    """ None if the merkle root of block matches its header, else its start offset. """
+    return None if block.verify_merkle() else block.start_pos
+
+
+def _collect(acc, offset):
+    if offset is not None:
+        acc.append(offset)
+    return acc
+
+
+def verify_merkle_file(block_filename, workers=None, chunk_blocks=256, xor_key=None):
+    """ BlockFile.verify_merkle() of one file, on a process pool. """
+    mismatches = []
+    for _, chunk in scan_file(block_filename, merkle_mismatch, _collect, [], workers, chunk_blocks, lazy=True,
+                              xor_key=xor_key):
+        mismatches.extend(chunk)
+    return mismatches
+
+
+def verify_merkle_directory(directory, workers=None, pattern='blk*.dat'):
+    """ Yields (block_filename, start offsets of mismatching blocks) per blk file of directory. """
+    return scan_directory(directory, merkle_mismatch, _collect, [], workers, True, pattern, lazy=True)
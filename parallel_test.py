@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+import parallel
+import scanner
+from checkpoint import load_checkpoint
+
+def count_txs(block):
+    return block.tx_count
+
+def block_time(block):
+    return block.block_header.time
+
+def add(acc, n):
+    return acc + n
+
+class TestScanDirectory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        for name, source in (("blk00000.dat", "1M.dat"), ("blk00001.dat", "blk01234.001")):
+            os.symlink(os.path.abspath(source), os.path.join(self.tmp.name, name))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_ordered_results(self):
+        results = list(parallel.scan_directory(self.tmp.name, count_txs, workers=2, lazy=True))
+        self.assertEqual([os.path.basename(f) for f, _ in results], ["blk00000.dat", "blk00001.dat"])
+        self.assertEqual(len(results[0][1]), 4522)
+        self.assertEqual(results[0][1][:3], [1, 1, 1])
+
+    def test_reducer(self):
+        expected = {"blk00000.dat": sum(count_txs(b) for b in parallel.BlockFile("1M.dat", True).get_next_block()),
+                    "blk00001.dat": sum(count_txs(b) for b in parallel.BlockFile("blk01234.001", True).get_next_block())}
+        results = parallel.scan_directory(self.tmp.name, count_txs, reducer=add, initial=0,
+                                          workers=2, ordered=False, lazy=True)
+        self.assertEqual({os.path.basename(f): r for f, r in results}, expected)
+
+    def test_checkpoint_resume(self):
+        filename = os.path.join(self.tmp.name, "scan.checkpoint")
+        for block_filename, _ in parallel.scan_directory(self.tmp.name, count_txs, add, 0, workers=2, lazy=True,
+                                                         checkpoint_filename=filename):
+            self.assertEqual(os.path.basename(block_filename), "blk00000.dat")
+            break
+        # The first result was handed out but never taken as processed.
+        self.assertFalse(os.path.exists(filename))
+        results = parallel.scan_directory(self.tmp.name, count_txs, add, 0, workers=2, lazy=True,
+                                          checkpoint_filename=filename)
+        self.assertEqual([os.path.basename(f) for f, _ in results], ["blk00000.dat", "blk00001.dat"])
+        results = parallel.scan_directory(self.tmp.name, count_txs, add, 0, workers=2, lazy=True,
+                                          checkpoint_filename=filename)
+        self.assertEqual(list(results), [])
+        with self.assertRaises(ValueError):
+            list(parallel.scan_directory(self.tmp.name, count_txs, workers=2, ordered=False,
+                                         checkpoint_filename=filename))
+
+    def test_scanner_resumes_checkpoint(self):
+        filename = os.path.join(self.tmp.name, "scan.checkpoint")
+        results = parallel.scan_directory(self.tmp.name, count_txs, add, 0, workers=2, lazy=True,
+                                          checkpoint_filename=filename)
+        next(results)
+        next(results)
+        results.close()
+        # Saved without a block count, scanner numbers on after the 4522 blocks of blk00000.dat.
+        checkpoint = load_checkpoint(filename)
+        self.assertIsNone(checkpoint.block_count)
+        paths = parallel.list_block_files(self.tmp.name)
+        blocks = scanner.iter_blocks(paths, resume=checkpoint)
+        self.assertEqual([(os.path.basename(path), number) for path, number, _ in blocks], [("blk00001.dat", 4522)])
+        self.assertEqual(list(scanner.iter_blocks(paths, stop=4522, resume=checkpoint)), [])
+
+
+class TestScanFile(unittest.TestCase):
+
+    def test_ranges_match_sequential_scan(self):
+        expected = [b.block_header.time for b in parallel.BlockFile("1M.dat", True).get_next_block()]
+        results = list(parallel.scan_file("1M.dat", block_time, workers=3, chunk_blocks=1000, lazy=True))
+        self.assertEqual(len(results), 5)
+        self.assertEqual([t for _, chunk in results for t in chunk], expected)
+        self.assertEqual(results[0][0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
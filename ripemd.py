@@ -385,6 +385,111 @@ def RMD160Final(ctx):
     return struct.pack("<5L", *ctx.state)
 
 
+#
+# Fast path.
+#
+# The same compression function on Python ints: the message schedule and
+# shift amounts come from tables, the boolean functions are inlined per
+# round and both lines run in the same loop, instead of one R() and one
+# Fj() call per step.
+
+_RL = [
+    0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
+    7, 4, 13, 1, 10, 6, 15, 3, 12, 0, 9, 5, 2, 14, 11, 8,
+    3, 10, 14, 4, 9, 15, 8, 1, 2, 7, 0, 6, 13, 11, 5, 12,
+    1, 9, 11, 10, 0, 8, 12, 4, 13, 3, 7, 15, 14, 5, 6, 2,
+    4, 0, 5, 9, 7, 12, 2, 10, 14, 1, 3, 8, 11, 6, 15, 13]
+_RR = [
+    5, 14, 7, 0, 9, 2, 11, 4, 13, 6, 15, 8, 1, 10, 3, 12,
+    6, 11, 3, 7, 0, 13, 5, 10, 14, 15, 8, 12, 4, 9, 1, 2,
+    15, 5, 1, 3, 7, 14, 6, 9, 11, 8, 12, 2, 10, 0, 4, 13,
+    8, 6, 4, 1, 3, 11, 15, 0, 5, 12, 2, 13, 9, 7, 10, 14,
+    12, 15, 10, 4, 1, 5, 8, 7, 6, 2, 13, 14, 0, 3, 9, 11]
+_SL = [
+    11, 14, 15, 12, 5, 8, 7, 9, 11, 13, 14, 15, 6, 7, 9, 8,
+    7, 6, 8, 13, 11, 9, 7, 15, 7, 12, 15, 9, 11, 7, 13, 12,
+    11, 13, 6, 7, 14, 9, 13, 15, 14, 8, 13, 6, 5, 12, 7, 5,
+    11, 12, 14, 15, 14, 15, 9, 8, 9, 14, 5, 6, 8, 6, 5, 12,
+    9, 15, 5, 11, 6, 8, 13, 12, 5, 12, 13, 14, 11, 8, 5, 6]
+_SR = [
+    8, 9, 9, 11, 13, 15, 15, 5, 7, 7, 8, 11, 14, 14, 12, 6,
+    9, 13, 15, 7, 12, 8, 9, 11, 7, 7, 12, 7, 6, 15, 13, 11,
+    9, 7, 15, 11, 8, 6, 6, 14, 12, 13, 5, 14, 13, 13, 7, 5,
+    15, 5, 8, 11, 14, 14, 6, 14, 6, 9, 12, 9, 12, 5, 15, 8,
+    8, 5, 12, 9, 12, 5, 14, 6, 8, 13, 6, 5, 15, 13, 11, 11]
+
+# One (rl, sl, rr, sr) tuple per step, 16 steps per round.
+_ROUNDS = [list(zip(_RL[i:i + 16], _SL[i:i + 16], _RR[i:i + 16], _SR[i:i + 16]))
+           for i in range(0, 80, 16)]
+
+_BLOCKS = struct.Struct('<16L')
+
+
+def _compress(state, x):
+    m = 0xffffffff
+    al = ar = state[0]
+    bl = br = state[1]
+    cl = cr = state[2]
+    dl = dr = state[3]
+    el = er = state[4]
+    r1, r2, r3, r4, r5 = _ROUNDS
+
+    for rl, sl, rr, sr in r1:
+        t = (al + (bl ^ cl ^ dl) + x[rl]) & m
+        t = (((t << sl) | (t >> (32 - sl))) + el) & m
+        al, el, dl, cl, bl = el, dl, ((cl << 10) | (cl >> 22)) & m, bl, t
+        t = (ar + (br ^ (cr | (dr ^ m))) + x[rr] + KK0) & m
+        t = (((t << sr) | (t >> (32 - sr))) + er) & m
+        ar, er, dr, cr, br = er, dr, ((cr << 10) | (cr >> 22)) & m, br, t
+    for rl, sl, rr, sr in r2:
+        t = (al + ((bl & cl) | ((bl ^ m) & dl)) + x[rl] + K1) & m
+        t = (((t << sl) | (t >> (32 - sl))) + el) & m
+        al, el, dl, cl, bl = el, dl, ((cl << 10) | (cl >> 22)) & m, bl, t
+        t = (ar + ((br & dr) | (cr & (dr ^ m))) + x[rr] + KK1) & m
+        t = (((t << sr) | (t >> (32 - sr))) + er) & m
+        ar, er, dr, cr, br = er, dr, ((cr << 10) | (cr >> 22)) & m, br, t
+    for rl, sl, rr, sr in r3:
+        t = (al + ((bl | (cl ^ m)) ^ dl) + x[rl] + K2) & m
+        t = (((t << sl) | (t >> (32 - sl))) + el) & m
+        al, el, dl, cl, bl = el, dl, ((cl << 10) | (cl >> 22)) & m, bl, t
+        t = (ar + ((br | (cr ^ m)) ^ dr) + x[rr] + KK2) & m
+        t = (((t << sr) | (t >> (32 - sr))) + er) & m
+        ar, er, dr, cr, br = er, dr, ((cr << 10) | (cr >> 22)) & m, br, t
+    for rl, sl, rr, sr in r4:
+        t = (al + ((bl & dl) | (cl & (dl ^ m))) + x[rl] + K3) & m
+        t = (((t << sl) | (t >> (32 - sl))) + el) & m
+        al, el, dl, cl, bl = el, dl, ((cl << 10) | (cl >> 22)) & m, bl, t
+        t = (ar + ((br & cr) | ((br ^ m) & dr)) + x[rr] + KK3) & m
+        t = (((t << sr) | (t >> (32 - sr))) + er) & m
+        ar, er, dr, cr, br = er, dr, ((cr << 10) | (cr >> 22)) & m, br, t
+    for rl, sl, rr, sr in r5:
+        t = (al + (bl ^ (cl | (dl ^ m))) + x[rl] + K4) & m
+        t = (((t << sl) | (t >> (32 - sl))) + el) & m
+        al, el, dl, cl, bl = el, dl, ((cl << 10) | (cl >> 22)) & m, bl, t
+        t = (ar + (br ^ cr ^ dr) + x[rr]) & m
+        t = (((t << sr) | (t >> (32 - sr))) + er) & m
+        ar, er, dr, cr, br = er, dr, ((cr << 10) | (cr >> 22)) & m, br, t
+
+    return ((state[1] + cl + dr) & m, (state[2] + dl + er) & m,
+            (state[3] + el + ar) & m, (state[4] + al + br) & m,
+            (state[0] + bl + cr) & m)
+
+
+def ripemd160(data):
+    """Returns the RIPEMD-160 digest of data (a bytes-like object)."""
+    data = bytes(data)
+    length = len(data)
+    padding = 64 - ((length + 9) % 64)
+    if padding == 64:
+        padding = 0
+    data += b'\x80' + b'\x00' * padding + struct.pack('<Q', 8 * length)
+    state = (0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476, 0xC3D2E1F0)
+    unpack_from = _BLOCKS.unpack_from
+    for off in range(0, len(data), 64):
+        state = _compress(state, unpack_from(data, off))
+    return struct.pack('<5L', *state)
+
+
 assert '37f332f68db77bd9d7edd4969571ad671cf9dd3b' == \
        new(b'The quick brown fox jumps over the lazy dog').hexdigest()
 assert '132072df690933835eb8b6ad0b77e7b6f14acad7' == \
@@ -0,0 +1,39 @@
+import os
+import unittest
+import crypto_lib
+import ripemd
+
+class TestRipemd160(unittest.TestCase):
+
+    VECTORS = [
+        (b'', '9c1185a5c5e9fc54612808977ee8f548b2258d31'),
+        (b'abc', '8eb208f7e05d987a9b044a8e98c6b087f15a0bfc'),
+        (b'The quick brown fox jumps over the lazy dog', '37f332f68db77bd9d7edd4969571ad671cf9dd3b'),
+        (b'The quick brown fox jumps over the lazy cog', '132072df690933835eb8b6ad0b77e7b6f14acad7'),
+        (b'12345678901234567890123456789012345678901234567890123456789012345678901234567890',
+         '9b752e45573d4b39f4dbd3323cab82bf63326bfb'),
+    ]
+
+    def test_vectors(self):
+        for data, digest in self.VECTORS:
+            self.assertEqual(ripemd.new(data).hexdigest(), digest)
+            self.assertEqual(ripemd.ripemd160(data).hex(), digest)
+
+    def test_backends_agree(self):
+        backends = dict(crypto_lib.RIPEMD160_BACKENDS)
+        try:
+            backends['openssl'](b'')
+        except ValueError:
+            del backends['openssl']
+        for length in list(range(0, 130)) + [1000]:
+            data = os.urandom(length)
+            digests = set(backend(data) for backend in backends.values())
+            self.assertEqual(len(digests), 1, length)
+
+    def test_hash160_many(self):
+        pubkeys = [os.urandom(33) for _ in range(5)]
+        self.assertEqual(crypto_lib.hash160_many(pubkeys), [crypto_lib.hash160(k) for k in pubkeys])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,28 +1,332 @@
 #!/usr/bin/python
+import argparse
+import os
 import sys
-from block import BlockFile
+from block import BlockFile, OutputFilter
+from checkpoint import checkpointed, load_checkpoint
+from follow import BlockFollower
+from stream import BlockStream
+from crypto_op import SCRIPT_TYPE_NAMES
 
-def main():
-  """Print all detail of a specific block file, such as block00000.dat """
-  if len(sys.argv) < 2:
-    print('Usage: scan.py filename')
+FORMATS = ('human', 'jsonl', 'csv', 'tsv')
+
+# Inputs read with BlockStream rather than mapped: stdin and compressed files.
+STREAM_SUFFIXES = ('.gz', '.bz2', '.xz', '.zst')
+
+# --type takes the names of the output type field.
+SCRIPT_TYPES = {name: script_type for script_type, name in SCRIPT_TYPE_NAMES.items()}
+
+# Output rows, one per input and one per output. Each field has a type and
+# a getter per row kind, called as getter(block_no, tx_no, tx, index, obj),
+# None where the field does not apply (null in JSON, empty in CSV/TSV).
+FIELDS = {
+  'block': ('int', lambda b, t, tx, i, o: b, lambda b, t, tx, i, o: b),
+  'tx': ('int', lambda b, t, tx, i, o: t, lambda b, t, tx, i, o: t),
+  'txid': ('str', lambda b, t, tx, i, o: tx.tx_hash, lambda b, t, tx, i, o: tx.tx_hash),
+  'kind': ('str', lambda b, t, tx, i, o: 'input', lambda b, t, tx, i, o: 'output'),
+  'index': ('int', lambda b, t, tx, i, o: i, lambda b, t, tx, i, o: i),
+  'prev_txid': ('str', lambda b, t, tx, i, o: o.prev_hash, None),
+  'prev_vout': ('int', lambda b, t, tx, i, o: o.tx_outId, None),
+  'addr': ('str', None, lambda b, t, tx, i, o: o.addr),
+  'value': ('int', None, lambda b, t, tx, i, o: o.value),
+  'type': ('str', None, lambda b, t, tx, i, o: o.type),
+  'script': ('str', lambda b, t, tx, i, o: o.hex_str, lambda b, t, tx, i, o: o.hex_str),
+  'segments': ('list', lambda b, t, tx, i, o: o.segments, lambda b, t, tx, i, o: o.segments),
+}
+
+def segment_strings(segments):
+  # The coinbase input has its script hex instead of segments.
+  if isinstance(segments, str):
+    return [segments]
+  return [op.hex() if isinstance(op, bytes) else op for op in segments]
+
+def join_segments(getter):
+  return lambda b, t, tx, i, o: ' '.join(segment_strings(getter(b, t, tx, i, o)))
+
+def json_segments(getter):
+  return lambda b, t, tx, i, o: '["%s"]' % '","'.join(segment_strings(getter(b, t, tx, i, o)))
+
+def build_formatter(fmt, fields, kind):
+  """
+  Returns format_row(block_no, tx_no, tx, index, obj) -> line for the rows
+  of kind (1 input, 2 output). The line is one % template, only the
+  getters of the selected fields are called.
+  """
+  getters = []
+  parts = []
+  for name in fields:
+    field_type, getter = FIELDS[name][0], FIELDS[name][kind]
+    if fmt == 'jsonl':
+      if getter is None:
+        parts.append('"%s":null' % name)
+        continue
+      if field_type == 'str':
+        parts.append('"%s":"%%s"' % name)
+      else:
+        parts.append('"%s":%%s' % name)
+      if field_type == 'list':
+        getter = json_segments(getter)
+    else:
+      if getter is None:
+        parts.append('')
+        continue
+      parts.append('%s')
+      if field_type == 'list':
+        getter = join_segments(getter)
+    getters.append(getter)
+  if fmt == 'jsonl':
+    template = '{' + ','.join(parts) + '}\n'
   else:
-    block_file = BlockFile(sys.argv[1])
-    block_counter = 0
-    for block in block_file.get_next_block():
-      tx_counter = 0
-      for tx in block.txs:
-        print("Block:%d Tx:%d Tx_hash:%s" % (block_counter, tx_counter, tx.tx_hash))
+    template = (',' if fmt == 'csv' else '\t').join(parts) + '\n'
+  getters = tuple(getters)
+
+  def format_row(b, t, tx, i, o):
+    return template % tuple([getter(b, t, tx, i, o) for getter in getters])
+  return format_row
+
+def block_files(path):
+  if os.path.isdir(path):
+    from parallel import list_block_files
+    return list_block_files(path)
+  return [path]
+
+def scan_human(blocks, out, fields, output_filter=None):
+  """ With an output_filter, only the matching outputs and their txs are printed, no inputs. """
+  show_segments = 'segments' in fields
+  for block_counter, block in blocks:
+    lines = []
+    tx_counter = 0
+    for tx in block:
+      if output_filter is None:
+        inputs = tx.inputs
+        outputs = enumerate(tx.outputs)
+      else:
+        inputs = ()
+        outputs = output_filter.outputs(tx)
+        if not outputs:
+          tx_counter = tx_counter + 1
+          continue
+      lines.append("Block:%d Tx:%d Tx_hash:%s" % (block_counter, tx_counter, tx.tx_hash))
+      for input in inputs:
+        lines.append("input - %s:%d" % (input.prev_hash, input.idx))
+        if show_segments:
+          lines.append(str(input.segments))
+      for output_idx, output in outputs:
+        lines.append("output - %s:%d" % (output.addr, output_idx))
+        if show_segments:
+          lines.append(str(output.segments))
+      tx_counter = tx_counter + 1
+    if lines:
+      lines.append('')
+      out.write('\n'.join(lines).encode())
+
+def scan_rows(blocks, out, fmt, fields, output_filter=None):
+  """ With an output_filter, only the rows of the matching outputs are emitted. """
+  format_input = build_formatter(fmt, fields, 1)
+  format_output = build_formatter(fmt, fields, 2)
+  if fmt != 'jsonl':
+    out.write(((',' if fmt == 'csv' else '\t').join(fields) + '\n').encode())
+  for block_counter, block in blocks:
+    rows = []
+    tx_counter = 0
+    for tx in block:
+      if output_filter is None:
         for input in tx.inputs:
-          print("input - %s:%d" % (input.prev_hash, input.idx))
-          print(input.segments)
-        output_idx = 0
-        for output in tx.outputs:
-          print("output - %s:%d" % (output.addr, output_idx))
-          print(output.segments)
-          output_idx += 1
-        tx_counter = tx_counter + 1
-      block_counter = block_counter + 1
+          rows.append(format_input(block_counter, tx_counter, tx, input.idx, input))
+        outputs = enumerate(tx.outputs)
+      else:
+        outputs = output_filter.outputs(tx)
+      for output_idx, output in outputs:
+        rows.append(format_output(block_counter, tx_counter, tx, output_idx, output))
+      tx_counter = tx_counter + 1
+    if rows:
+      out.write(''.join(rows).encode())
+
+def filter_blocks(blocks, base, start=None, stop=None, min_time=None, max_time=None):
+  """
+  (number, block) of blocks numbered from base on, with the iter_blocks()
+  filters checked on the decoded headers, for sources that cannot be
+  walked by offset.
+  """
+  number = base
+  for block in blocks:
+    if stop is not None and number >= stop:
+      break
+    time = block.block_header.time
+    if ((start is None or number >= start) and (min_time is None or time >= min_time)
+        and (max_time is None or time <= max_time)):
+      yield number, block
+    number += 1
+
+def follow_blocks(path, offset, base, start=None, stop=None, min_time=None, max_time=None):
+  """ iter_blocks() for a blk file that is still being written, see BlockFollower. """
+  follower = BlockFollower(path, offset)
+  try:
+    for number, block in filter_blocks(follower, base, start, stop, min_time, max_time):
+      yield follower.block_filename, number, block
+  finally:
+    follower.close()
+
+def stream_blocks(path, start=None, stop=None, min_time=None, max_time=None, skipped=None):
+  """ iter_blocks() for stdin ('-') or a compressed blk file, see BlockStream. """
+  stream = BlockStream(sys.stdin.buffer if path == '-' else path, lazy=True)
+  try:
+    for number, block in filter_blocks(stream, 0, start, stop, min_time, max_time):
+      yield path, number, block
+    if skipped is not None:
+      skipped.extend((path, skip_start, skip_end) for skip_start, skip_end in stream.skipped)
+  finally:
+    # Also when the consumer stops early, e.g. at --stop.
+    stream.close()
+
+def is_stream(path):
+  return path == '-' or path.endswith(STREAM_SUFFIXES)
+
+def iter_blocks(paths, start=None, stop=None, min_time=None, max_time=None, resume=None, follow=False,
+                skipped=None):
+  """
+  Yields (path, number, block) over the blk files, numbered in file order
+  across them. The block range and times are checked before any tx is
+  decoded. With resume, a Checkpoint, the scan seeks to its file and
+  offset and numbers on from its block_count; without one (checkpoints of
+  parallel.scan_directory()), the blocks before the checkpoint are counted
+  from their prefixes. With follow, the last file
+  is tailed instead, on to the files the node creates after it. The
+  (path, start, end) ranges of padding and damaged data passed over are
+  appended to skipped.
+  """
+  base = 0
+  offset = 0
+  if resume is not None:
+    names = [os.path.abspath(path) for path in paths]
+    index = names.index(os.path.abspath(resume.block_filename))
+    base = resume.block_count
+    offset = resume.offset
+    if base is None:
+      base = sum(len(BlockFile(path).get_block_offsets()) for path in paths[:index])
+      base += sum(1 for block_offset in BlockFile(paths[index]).get_block_offsets() if block_offset < offset)
+    paths = paths[index:]
+  for i, path in enumerate(paths):
+    if follow and i == len(paths) - 1:
+      yield from follow_blocks(path, offset, base, start, stop, min_time, max_time)
+      return
+    block_file = BlockFile(path, lazy=True)
+    # Only the block prefixes are read to count the blocks.
+    count = len(block_file.get_block_offsets(offset))
+    file_start = max(start - base, 0) if start is not None else None
+    file_stop = max(stop - base, 0) if stop is not None else None
+    if skipped is not None:
+      skipped.extend((path, skip_start, skip_end) for skip_start, skip_end in block_file.skipped)
+    for number, block in block_file.iter_blocks(file_start, file_stop, min_time, max_time, offset):
+      yield path, base + number, block
+    base += count
+    offset = 0
+    if stop is not None and base >= stop:
+      break
+
+def counted(blocks, stats):
+  """ (number, block) of the (path, number, block) items, counting them in stats. """
+  for path, number, block in blocks:
+    stats['blocks'] += 1
+    yield number, block
+
+def print_stats(block_count, skipped):
+  lines = ["blocks: %d" % block_count,
+           "skipped: %d bytes in %d ranges" % (sum(end - start for _, start, end in skipped), len(skipped))]
+  for path, start, end in skipped:
+    lines.append("  %s %d-%d (%d bytes)" % (path, start, end, end - start))
+  sys.stderr.write('\n'.join(lines) + '\n')
+
+def flushed(blocks, out):
+  """ Flushes out once each block is written, so that followed blocks show up right away. """
+  for item in blocks:
+    yield item
+    out.flush()
+
+def sync_output(out):
+  """ Flushes out and, unless it is a pipe or a terminal, gets it on disk. """
+  out.flush()
+  try:
+    os.fsync(out.fileno())
+  except OSError:
+    pass
+
+def parse_args(argv):
+  parser = argparse.ArgumentParser(description="Print the transactions of a blk file, or of a directory of them.")
+  parser.add_argument('path', help="blk file, e.g. blk00000.dat, blocks directory, "
+                                   "compressed blk file (%s) or - for stdin" % ' '.join(STREAM_SUFFIXES))
+  parser.add_argument('--format', choices=FORMATS, default='human', help="output format (default: human)")
+  parser.add_argument('--fields', default=','.join(FIELDS),
+                      help="comma separated fields to emit, out of %s" % ','.join(FIELDS))
+  parser.add_argument('--start', type=int, help="first block number, in file order")
+  parser.add_argument('--stop', type=int, help="block number to stop before")
+  parser.add_argument('--min-time', type=int, help="skip blocks with an earlier header time (unix)")
+  parser.add_argument('--max-time', type=int, help="skip blocks with a later header time (unix)")
+  parser.add_argument('--type', action='append',
+                      help="only outputs of this script type (repeatable), out of %s" % ','.join(SCRIPT_TYPES))
+  parser.add_argument('--address', action='append', help="only outputs paying this address (repeatable)")
+  parser.add_argument('--follow', action='store_true',
+                      help="keep waiting for new blocks at the end of the last blk file, and the next ones")
+  parser.add_argument('--stats', action='store_true',
+                      help="print the block count and the skipped padding or damaged ranges to stderr")
+  parser.add_argument('--checkpoint', help="file to save the scan position to")
+  parser.add_argument('--checkpoint-interval', type=int, default=5000,
+                      help="blocks between checkpoints (default: 5000)")
+  parser.add_argument('--resume', action='store_true', help="continue from the --checkpoint file, if any")
+  args = parser.parse_args(argv)
+  args.fields = [name for name in args.fields.split(',') if name]
+  for name in args.fields:
+    if name not in FIELDS:
+      parser.error("unknown field %r" % name)
+  if args.type is not None:
+    for name in args.type:
+      if name not in SCRIPT_TYPES:
+        parser.error("unknown script type %r, out of %s" % (name, ','.join(SCRIPT_TYPES)))
+  if args.resume and args.checkpoint is None:
+    parser.error("--resume needs --checkpoint")
+  if is_stream(args.path) and (args.follow or args.checkpoint is not None):
+    parser.error("--follow and --checkpoint need a blk file or directory, not a stream")
+  return args
+
+def main(argv=None):
+  """Print all detail of a specific block file, such as block00000.dat """
+  args = parse_args(sys.argv[1:] if argv is None else argv)
+  paths = block_files(args.path)
+  resume = None
+  if args.resume:
+    resume = load_checkpoint(args.checkpoint)
+    if resume is not None and os.path.abspath(resume.block_filename) not in map(os.path.abspath, paths):
+      sys.exit("scanner.py: error: checkpoint file %s is not under %s" % (resume.block_filename, args.path))
+  skipped = []
+  if is_stream(args.path):
+    blocks = stream_blocks(args.path, args.start, args.stop, args.min_time, args.max_time, skipped)
+  else:
+    blocks = iter_blocks(paths, args.start, args.stop, args.min_time, args.max_time, resume, args.follow, skipped)
+  stats = {'blocks': 0}
+  output_filter = None
+  if args.type is not None or args.address is not None:
+    script_types = [SCRIPT_TYPES[name] for name in args.type] if args.type is not None else None
+    try:
+      output_filter = OutputFilter(script_types, args.address)
+    except ValueError as e:
+      sys.exit("scanner.py: error: %s" % e)
+  try:
+    with open(sys.stdout.fileno(), 'wb', buffering=1 << 20, closefd=False) as out:
+      if args.checkpoint is not None:
+        # The rows of the checkpointed blocks must not sit in the buffer.
+        blocks = checkpointed(blocks, args.checkpoint, args.checkpoint_interval, on_save=lambda: sync_output(out))
+      blocks = counted(blocks, stats)
+      if args.follow:
+        blocks = flushed(blocks, out)
+      if args.format == 'human':
+        scan_human(blocks, out, args.fields, output_filter)
+      else:
+        scan_rows(blocks, out, args.format, args.fields, output_filter)
+  except BrokenPipeError:
+    # The reader went away, e.g. piped into head.
+    sys.exit(1)
+  if args.stats:
+    print_stats(stats['blocks'], skipped)
 
 
 if __name__ == '__main__':
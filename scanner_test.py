@@ -0,0 +1,33 @@
+import io
+import json
+import unittest
+from block import BlockFile
+from scanner import build_formatter, scan_rows
+
+class TestScanner(unittest.TestCase):
+
+    def setUp(self):
+        self.tx = next(BlockFile("blk01234.001", lazy=True).get_next_block()).txs[0]
+
+    def test_formatters(self):
+        fields = ['txid', 'index', 'addr', 'value', 'segments']
+        output = self.tx.outputs[0]
+        row = json.loads(build_formatter('jsonl', fields, 2)(0, 0, self.tx, 0, output))
+        self.assertEqual(row, {"txid": self.tx.tx_hash, "index": 0, "addr": "1KFHE7w8BhaENAswwryaoccDb6qcT6DbYY",
+                               "value": 1252092588, "segments": ["OP_DUP", "OP_HASH160",
+                               "c825a1ecf2a6830c4401620c3a16f1995057c2ab", "OP_EQUALVERIFY", "OP_CHECKSIG"]})
+        row = build_formatter('csv', fields, 1)(0, 0, self.tx, 0, self.tx.inputs[0])
+        self.assertEqual(row, "%s,0,,,%s\n" % (self.tx.tx_hash, self.tx.inputs[0].hex_str))
+        self.assertEqual(build_formatter('tsv', ['kind', 'value'], 2)(0, 0, self.tx, 1, self.tx.outputs[1]),
+                         "output\t0\n")
+
+    def test_scan_rows(self):
+        out = io.BytesIO()
+        scan_rows(BlockFile("blk01234.001", lazy=True).iter_blocks(), out, 'csv', ['kind', 'value'])
+        lines = out.getvalue().decode().splitlines()
+        self.assertEqual(lines[0], "kind,value")
+        self.assertEqual(lines[1:4], ["input,", "output,1252092588", "output,0"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import bz2
+import gzip
+import lzma
+import os
+
+from block import Block
+from crypto_lib import (Cursor, NETWORK_MAGIC_BYTES, is_block_at, unpack_block_prefix, xor_bytes)
+from crypto_op import MAX_BLOCK_SIZE, MIN_BLOCK_SIZE, NETWORK_MAGICS
+
+# Leading bytes of the compressed formats open_stream() recognizes.
+GZIP_MAGIC = b'\x1f\x8b'
+BZIP2_MAGIC = b'BZh'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+class _PrefixedReader:
+    """ Reads the bytes already taken off a stream, then the rest of the stream. """
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=-1):
+        if self.prefix:
+            if size is None or size < 0:
+                data = self.prefix + self.stream.read()
+                self.prefix = b''
+                return data
+            data = self.prefix[:size]
+            self.prefix = self.prefix[size:]
+            return data
+        return self.stream.read(size)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self.stream.close()
+
+
+def _zstd_reader(stream):
+    try:
+        from compression import zstd
+        return zstd.ZstdFile(stream)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd input needs Python 3.14 or the zstandard package")
+    return zstandard.ZstdDecompressor().stream_reader(stream)
+
+
+def open_stream(source):
+    """
+    A binary reader for source, a file name or any object with read()
+    (pipe, socket.makefile('rb'), HTTP response...), decompressing gzip,
+    bzip2, xz and, where a zstd module is there, zstd by their magic
+    bytes. Nothing needs to be seekable.
+    """
+    if isinstance(source, (str, bytes, os.PathLike)):
+        source = open(source, 'rb')
+    head = b''
+    while len(head) < 6:
+        data = source.read(6 - len(head))
+        if not data:
+            break
+        head += data
+    reader = _PrefixedReader(head, source)
+    if head.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=reader)
+    if head.startswith(BZIP2_MAGIC):
+        return bz2.BZ2File(reader)
+    if head.startswith(XZ_MAGIC):
+        return lzma.LZMAFile(reader)
+    if head.startswith(ZSTD_MAGIC):
+        return _zstd_reader(reader)
+    return reader
+
+
+class BlockStream:
+    """
+    Parses blocks out of a byte stream read chunk_size bytes at a time, see
+    open_stream() for the sources. The rolling buffer holds the unparsed
+    tail only, at most a block and a chunk. Each block gets a copy of its
+    bytes to decode from, so the buffer can be compacted under it; the
+    blocks have stream offsets in start_pos and end_pos.
+
+    As for BlockFile, data that is not a complete block is skipped up to
+    the next magic number and the (start, end) stream ranges are kept in
+    skipped. xor_key de-obfuscates the stream of an obfuscated blk file.
+    """
+    def __init__(self, source, lazy=False, chunk_size=1 << 22, xor_key=None):
+        # The file opened here, the decompressors do not close it.
+        self.file = open(source, 'rb') if isinstance(source, (str, bytes, os.PathLike)) else None
+        self.stream = open_stream(self.file or source)
+        self.lazy = lazy
+        self.chunk_size = chunk_size
+        self.xor_key = xor_key if xor_key and xor_key.strip(b'\0') else None
+        self.skipped = []
+        # Stream offset of buf[0].
+        self.offset = 0
+
+    def close(self):
+        self.stream.close()
+        if self.file is not None:
+            self.file.close()
+
+    def _read(self, buf):
+        """ Appends a chunk to buf, False at the end of the stream. """
+        data = self.stream.read(self.chunk_size)
+        if not data:
+            return False
+        if self.xor_key is not None:
+            data = xor_bytes(data, self.xor_key, self.offset + len(buf))
+        buf += data
+        return True
+
+    def _skip(self, start, end):
+        if self.skipped and self.skipped[-1][1] == start:
+            self.skipped[-1] = (self.skipped[-1][0], end)
+        else:
+            self.skipped.append((start, end))
+
+    def __iter__(self):
+        buf = bytearray()
+        pos = 0
+        eof = False
+        while True:
+            if pos > self.chunk_size:
+                del buf[:pos]
+                self.offset += pos
+                pos = 0
+            if len(buf) - pos < 8:
+                if eof or not self._read(buf):
+                    eof = True
+                    if pos < len(buf):
+                        self._skip(self.offset + pos, self.offset + len(buf))
+                    return
+                continue
+            magic, block_size = unpack_block_prefix(buf, pos)
+            if magic in NETWORK_MAGICS and MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+                end = pos + 8 + block_size
+                # The 4 bytes after the block tell a torn block apart.
+                if end + 4 > len(buf) and not eof:
+                    eof = not self._read(buf)
+                    continue
+                if is_block_at(buf, pos):
+                    # One copy, and the views are gone before buf is resized.
+                    with memoryview(buf) as view, view[pos:end] as data:
+                        block = Block(Cursor(bytes(data)), self.lazy)
+                    block.start_pos += self.offset + pos
+                    block.end_pos += self.offset + pos
+                    pos = end
+                    yield block
+                    continue
+            # Not a block here: jump to the next magic number in the buffer.
+            found = [p for p in (buf.find(pattern, pos + 1) for pattern in NETWORK_MAGIC_BYTES) if p >= 0]
+            if found:
+                self._skip(self.offset + pos, self.offset + min(found))
+                pos = min(found)
+                continue
+            # Keep the last 3 bytes, a magic number may start there.
+            skip_to = max(pos + 1, len(buf) - 3)
+            self._skip(self.offset + pos, self.offset + skip_to)
+            pos = skip_to
+            if eof or not self._read(buf):
+                eof = True
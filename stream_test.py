@@ -0,0 +1,73 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+import scanner
+from block import BlockFile
+from stream import BlockStream
+
+class TestBlockStream(unittest.TestCase):
+
+    def setUp(self):
+        with open("1M.dat", "rb") as f:
+            self.data = f.read()
+        self.blocks = [(block.start_pos, block.block_header.block_hash)
+                       for block in BlockFile("1M.dat", lazy=True).get_next_block()]
+
+    def stream_blocks(self, source, **kwargs):
+        stream = BlockStream(source, lazy=True, **kwargs)
+        blocks = [(block.start_pos, block.block_header.block_hash) for block in stream]
+        stream.close()
+        return blocks, stream.skipped
+
+    def test_compressed(self):
+        for compress in (gzip.compress, bz2.compress, lzma.compress, lambda data: data):
+            blocks, skipped = self.stream_blocks(io.BytesIO(compress(self.data)), chunk_size=65536)
+            self.assertEqual(blocks, self.blocks)
+            # 1M.dat ends with part of a block.
+            self.assertEqual(skipped, [(1048537, 1048576)])
+
+    def test_pipe(self):
+        process = subprocess.Popen(["gzip", "-c", "1M.dat"], stdout=subprocess.PIPE)
+        blocks, _ = self.stream_blocks(process.stdout, chunk_size=4096)
+        process.wait()
+        self.assertEqual(blocks, self.blocks)
+
+    def test_resync_and_txs(self):
+        offsets = [start for start, _ in self.blocks]
+        damaged = self.data[:offsets[10]] + b"\1" * 5000 + self.data[offsets[10]:offsets[20]] + b"\0" * 3000
+        stream = BlockStream(io.BytesIO(damaged), chunk_size=1000)
+        blocks = list(stream)
+        self.assertEqual(len(blocks), 20)
+        self.assertEqual(stream.skipped, [(offsets[10], offsets[10] + 5000), (offsets[20] + 5000, len(damaged))])
+        self.assertEqual(blocks[0].txs[0].tx_hash, "4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b")
+
+    def test_closed_on_early_stop(self):
+        streams = []
+
+        class RecordedStream(BlockStream):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                streams.append(self)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "blk00000.dat.gz")
+            with open(filename, "wb") as f:
+                f.write(gzip.compress(self.data))
+            with mock.patch("scanner.BlockStream", RecordedStream):
+                blocks = scanner.stream_blocks(filename)
+                self.assertEqual(next(blocks)[1], 0)
+                # As when the consumer breaks out of its loop.
+                blocks.close()
+            # The gzip reader and the file under it.
+            self.assertTrue(streams[0].stream.closed)
+            self.assertTrue(streams[0].file.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,335 @@
+import heapq
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+
+from crypto_op import SCRIPT_OP_RETURN
+
+# txid (wire byte order) + vout
+OUTPOINT_SIZE = 36
+
+_VOUT = struct.Struct('<I')
+# First 8 txid bytes and the vout of a key.
+_SLOT_HASH = struct.Struct('<Q24xI')
+# First 8 key bytes as an int that sorts like the bytes.
+_KEY_PREFIX = struct.Struct('>Q')
+# Spilled output record: outpoint, value, script type, payload length, then the payload.
+_RUN_RECORD = struct.Struct('<36sQBI')
+
+# Bytes per slot of the table columns: key, used flag, value, type, payload position and length.
+_SLOT_SIZE = OUTPOINT_SIZE + 1 + 8 + 1 + 8 + 4
+# Scratch per entry when sorting for a spill: a 96-bit int and its list pointer.
+_SORT_ENTRY_SIZE = 48
+
+
+def outpoint(txid_raw, vout):
+    """ The 36-byte key of output vout of the tx with digest txid_raw. """
+    return bytes(txid_raw) + _VOUT.pack(vout)
+
+
+def _sorted_slots(keys, slots):
+    """
+    Yields the slots, indices of 36-byte keys in keys, in key order. They
+    are sorted as one int each of the first 8 key bytes and the slot, so
+    no key is copied; only the slots sharing those bytes (the outputs of
+    one tx) are sorted on the whole key.
+    """
+    prefix = _KEY_PREFIX.unpack_from
+    order = sorted(prefix(keys, i * OUTPOINT_SIZE)[0] << 32 | i for i in slots)
+    run = []
+    last = None
+    for item in order:
+        if item >> 32 != last:
+            if len(run) > 1:
+                run.sort(key=lambda i: keys[i * OUTPOINT_SIZE:(i + 1) * OUTPOINT_SIZE])
+            yield from run
+            run = []
+            last = item >> 32
+        run.append(item & 0xffffffff)
+    if len(run) > 1:
+        run.sort(key=lambda i: keys[i * OUTPOINT_SIZE:(i + 1) * OUTPOINT_SIZE])
+    yield from run
+
+
+class _OutpointTable:
+    """
+    Open addressing (linear probing) hash table of outpoints. The keys,
+    values, script types and payload references live in flat array
+    columns, the payloads themselves in one bytearray heap.
+    """
+    def __init__(self, capacity):
+        size = 16
+        while size < capacity:
+            size *= 2
+        self.mask = size - 1
+        self.keys = bytearray(OUTPOINT_SIZE * size)
+        self.used = bytearray(size)
+        self.values = array('Q', [0]) * size
+        self.types = bytearray(size)
+        self.payload_pos = array('Q', [0]) * size
+        self.payload_len = array('I', [0]) * size
+        self.heap = bytearray()
+        self.count = 0
+        # Heap bytes of removed or replaced payloads.
+        self.garbage = 0
+
+    def memory_size(self):
+        return len(self.used) * _SLOT_SIZE + len(self.heap)
+
+    def _home(self, key):
+        low, vout = _SLOT_HASH.unpack_from(key)
+        return (low ^ (vout * 0x9E3779B97F4A7C15)) & self.mask
+
+    def _find(self, key):
+        """ Slot of key, or the empty slot where it would go, and whether it was found. """
+        keys = self.keys
+        used = self.used
+        mask = self.mask
+        i = self._home(key)
+        while used[i]:
+            start = i * OUTPOINT_SIZE
+            if keys[start:start + OUTPOINT_SIZE] == key:
+                return i, True
+            i = (i + 1) & mask
+        return i, False
+
+    def put(self, key, value, script_type, payload):
+        if (self.count + 1) * 10 > len(self.used) * 7:
+            self._resize(2 * len(self.used))
+        i, found = self._find(key)
+        if found:
+            self.garbage += self.payload_len[i]
+        else:
+            self.count += 1
+            self.used[i] = 1
+            self.keys[i * OUTPOINT_SIZE:(i + 1) * OUTPOINT_SIZE] = key
+        self.values[i] = value
+        self.types[i] = script_type
+        self.payload_pos[i] = len(self.heap)
+        self.payload_len[i] = len(payload)
+        self.heap += payload
+
+    def get(self, key):
+        i, found = self._find(key)
+        if not found:
+            return None
+        return self._entry(i)
+
+    def _entry(self, i):
+        pos = self.payload_pos[i]
+        return self.values[i], self.types[i], bytes(self.heap[pos:pos + self.payload_len[i]])
+
+    def remove(self, key):
+        """ Removes key, returns whether it was there. """
+        i, found = self._find(key)
+        if not found:
+            return False
+        self.garbage += self.payload_len[i]
+        # Backward shift deletion, so that no tombstones are needed.
+        keys = self.keys
+        used = self.used
+        mask = self.mask
+        j = i
+        while True:
+            j = (j + 1) & mask
+            if not used[j]:
+                break
+            k = self._home(keys[j * OUTPOINT_SIZE:(j + 1) * OUTPOINT_SIZE])
+            if (i < k <= j) if i <= j else (i < k or k <= j):
+                continue
+            keys[i * OUTPOINT_SIZE:(i + 1) * OUTPOINT_SIZE] = keys[j * OUTPOINT_SIZE:(j + 1) * OUTPOINT_SIZE]
+            self.values[i] = self.values[j]
+            self.types[i] = self.types[j]
+            self.payload_pos[i] = self.payload_pos[j]
+            self.payload_len[i] = self.payload_len[j]
+            i = j
+        used[i] = 0
+        self.count -= 1
+        return True
+
+    def slots(self):
+        """ The slots in use. """
+        used = self.used
+        return (i for i in range(len(used)) if used[i])
+
+    def items(self):
+        keys = self.keys
+        for i in self.slots():
+            yield (bytes(keys[i * OUTPOINT_SIZE:(i + 1) * OUTPOINT_SIZE]),) + self._entry(i)
+
+    def compact(self):
+        """ Drops the garbage from the heap, shrinking the table if it is mostly empty. """
+        self._resize(max(2 * self.count, 16))
+
+    def _resize(self, capacity):
+        """
+        Rehashes into capacity slots column by column. Only the payloads of
+        the entries still there are copied, so the garbage goes.
+        """
+        keys, used, values, types = self.keys, self.used, self.values, self.types
+        payload_pos, payload_len, heap = self.payload_pos, self.payload_len, self.heap
+        count = self.count
+        self.__init__(capacity)
+        new_keys, new_used, new_heap, mask = self.keys, self.used, self.heap, self.mask
+        for i in range(len(used)):
+            if not used[i]:
+                continue
+            key = keys[i * OUTPOINT_SIZE:(i + 1) * OUTPOINT_SIZE]
+            # The keys are distinct, the first empty slot is the one.
+            j = self._home(key)
+            while new_used[j]:
+                j = (j + 1) & mask
+            new_used[j] = 1
+            new_keys[j * OUTPOINT_SIZE:(j + 1) * OUTPOINT_SIZE] = key
+            self.values[j] = values[i]
+            self.types[j] = types[i]
+            pos = payload_pos[i]
+            length = payload_len[i]
+            self.payload_pos[j] = len(new_heap)
+            self.payload_len[j] = length
+            new_heap += heap[pos:pos + length]
+        self.count = count
+
+
+class UtxoSet:
+    """
+    Builds the unspent output set from blocks fed by the block iterator,
+    see add_block(). Outputs are kept in a compact open addressing table;
+    when its size passes memory_budget bytes, the table is compacted if
+    spends emptied most of it, else the outputs and the spends not
+    matched yet are written to sorted runs in spill_dir and the table
+    starts over, items() then merges the runs. The size counts the scratch
+    a spill needs to sort, so a spill stays within the budget too.
+
+    The set is the outputs minus the spent outpoints, so the blocks do not
+    have to come in chain order (blk files are in download order).
+    """
+    def __init__(self, memory_budget=1 << 30, spill_dir=None, capacity=1 << 16):
+        self.memory_budget = memory_budget
+        self.capacity = capacity
+        self.table = _OutpointTable(capacity)
+        # Spent outpoints that were not in the table, 36 bytes each.
+        self.spends = bytearray()
+        self.spill_dir = spill_dir
+        self.own_spill_dir = False
+        self.runs = []
+
+    def memory_size(self):
+        entries = self.table.count + len(self.spends) // OUTPOINT_SIZE
+        return self.table.memory_size() + len(self.spends) + entries * _SORT_ENTRY_SIZE
+
+    def _check_budget(self):
+        if self.memory_size() <= self.memory_budget:
+            return
+        table = self.table
+        if table.garbage * 2 > len(table.heap) or table.count * 4 < len(table.used):
+            table.compact()
+            if self.memory_size() <= self.memory_budget:
+                return
+        self.spill()
+
+    def add(self, key, value, script_type, payload):
+        self.table.put(key, value, script_type, payload)
+        self._check_budget()
+
+    def spend(self, key):
+        if not self.table.remove(key):
+            self.spends += key
+            self._check_budget()
+
+    def get(self, key):
+        """ (value, script type, payload) of an unspent output still in memory, else None. """
+        return self.table.get(key)
+
+    def add_block(self, block):
+        for tx in block.iter_txs():
+            for tx_input in tx.inputs:
+                if tx_input.tx_outId != 0xffffffff:  # Not coinbase
+                    self.spend(bytes(tx_input.prev_hash_raw) + _VOUT.pack(tx_input.tx_outId))
+            txid = tx.tx_hash_raw
+            for vout, tx_output in enumerate(tx.outputs):
+                script_type = tx_output.script_type
+                if script_type == SCRIPT_OP_RETURN:  # Provably unspendable
+                    continue
+                self.add(txid + _VOUT.pack(vout), tx_output.value, script_type, tx_output.payload)
+
+    def spill(self):
+        """ Writes the table and the pending spends to a pair of sorted runs. """
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='utxo-')
+            self.own_spill_dir = True
+        n = len(self.runs)
+        outputs_filename = os.path.join(self.spill_dir, 'outputs-%06d.run' % n)
+        spends_filename = os.path.join(self.spill_dir, 'spends-%06d.run' % n)
+        pack = _RUN_RECORD.pack
+        table = self.table
+        keys, values, types, heap = table.keys, table.values, table.types, table.heap
+        payload_pos, payload_len = table.payload_pos, table.payload_len
+        # Straight from the columns, the entries are never built as tuples.
+        with open(outputs_filename, 'wb', buffering=1 << 20) as f:
+            for i in _sorted_slots(keys, table.slots()):
+                pos = payload_pos[i]
+                length = payload_len[i]
+                f.write(pack(keys[i * OUTPOINT_SIZE:(i + 1) * OUTPOINT_SIZE], values[i], types[i], length))
+                f.write(heap[pos:pos + length])
+        spends = self.spends
+        with open(spends_filename, 'wb', buffering=1 << 20) as f:
+            for i in _sorted_slots(spends, range(len(spends) // OUTPOINT_SIZE)):
+                f.write(spends[i * OUTPOINT_SIZE:(i + 1) * OUTPOINT_SIZE])
+        self.runs.append((outputs_filename, spends_filename))
+        self.table = _OutpointTable(self.capacity)
+        self.spends = bytearray()
+
+    def items(self):
+        """ Yields (outpoint, value, script type, payload) of every unspent output. """
+        if not self.runs:
+            spent = set(bytes(self.spends[i:i + OUTPOINT_SIZE]) for i in range(0, len(self.spends), OUTPOINT_SIZE))
+            for item in self.table.items():
+                if item[0] not in spent:
+                    yield item
+            return
+        if self.table.count or self.spends:
+            self.spill()
+        outputs = heapq.merge(*[_read_outputs(o) for o, _ in self.runs])
+        spends = heapq.merge(*[_read_spends(s) for _, s in self.runs])
+        spent = next(spends, None)
+        for item in outputs:
+            key = item[0]
+            while spent is not None and spent < key:
+                spent = next(spends, None)
+            if spent != key:
+                yield item
+
+    def close(self):
+        """ Removes the spilled runs. """
+        for run in self.runs:
+            for filename in run:
+                os.remove(filename)
+        self.runs = []
+        if self.own_spill_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+            self.own_spill_dir = False
+
+
+def _read_outputs(filename):
+    size = _RUN_RECORD.size
+    unpack = _RUN_RECORD.unpack
+    with open(filename, 'rb', buffering=1 << 20) as f:
+        while True:
+            record = f.read(size)
+            if len(record) < size:
+                return
+            key, value, script_type, payload_len = unpack(record)
+            yield key, value, script_type, f.read(payload_len)
+
+
+def _read_spends(filename):
+    with open(filename, 'rb', buffering=1 << 20) as f:
+        while True:
+            key = f.read(OUTPOINT_SIZE)
+            if len(key) < OUTPOINT_SIZE:
+                return
+            yield key
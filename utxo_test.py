@@ -0,0 +1,103 @@
+import tempfile
+import tracemalloc
+import unittest
+from block import BlockFile
+from crypto_op import SCRIPT_OP_RETURN
+from utxo import UtxoSet, outpoint
+
+def reference_utxos(filename):
+    utxos = {}
+    for block in BlockFile(filename, lazy=True).get_next_block():
+        for tx in block:
+            for tx_input in tx.inputs:
+                utxos.pop(outpoint(tx_input.prev_hash_raw, tx_input.tx_outId), None)
+            for vout, tx_output in enumerate(tx.outputs):
+                if tx_output.script_type != SCRIPT_OP_RETURN:
+                    utxos[outpoint(tx.tx_hash_raw, vout)] = (tx_output.value, tx_output.script_type,
+                                                             bytes(tx_output.payload))
+    return utxos
+
+class TestUtxoSet(unittest.TestCase):
+
+    def build(self, utxo_set, blocks):
+        for block in blocks:
+            utxo_set.add_block(block)
+        return {key: (value, script_type, payload) for key, value, script_type, payload in utxo_set.items()}
+
+    def test_matches_reference(self):
+        expected = reference_utxos("1M.dat")
+        blocks = list(BlockFile("1M.dat", lazy=True).get_next_block())
+        utxo_set = UtxoSet()
+        self.assertEqual(self.build(utxo_set, blocks), expected)
+        self.assertEqual(utxo_set.runs, [])
+        key = next(iter(expected))
+        self.assertEqual(utxo_set.get(key), expected[key])
+
+    def test_spill_out_of_order(self):
+        expected = reference_utxos("1M.dat")
+        blocks = list(BlockFile("1M.dat", lazy=True).get_next_block())
+        with tempfile.TemporaryDirectory() as tmp:
+            utxo_set = UtxoSet(memory_budget=64 * 1024, spill_dir=tmp, capacity=256)
+            # Spends may come before the outputs they spend.
+            self.assertEqual(self.build(utxo_set, reversed(blocks)), expected)
+            self.assertGreater(len(utxo_set.runs), 1)
+            utxo_set.close()
+            self.assertEqual(utxo_set.runs, [])
+
+    def test_remove(self):
+        utxo_set = UtxoSet(capacity=16)
+        keys = [outpoint(bytes([i % 3]) * 32, i) for i in range(100)]
+        for i, key in enumerate(keys):
+            utxo_set.add(key, i, 2, bytes([i]) * 20)
+        for key in keys[::2]:
+            utxo_set.spend(key)
+        self.assertEqual(utxo_set.table.count, 50)
+        for i, key in enumerate(keys):
+            self.assertEqual(utxo_set.get(key), None if i % 2 == 0 else (i, 2, bytes([i]) * 20))
+
+    def test_spill_within_budget(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            utxo_set = UtxoSet(memory_budget=1 << 30, spill_dir=tmp)
+            # 10 outputs per tx, so runs of keys share their first bytes.
+            for i in range(20000):
+                utxo_set.add(outpoint(i.to_bytes(32, 'little'), i % 10), i, 2, bytes(20))
+            for i in range(1000):
+                utxo_set.spend(outpoint(bytes([1]) * 32, i))
+            size = utxo_set.memory_size()
+            tracemalloc.start()
+            try:
+                base = tracemalloc.get_traced_memory()[0]
+                utxo_set.spill()
+                peak = tracemalloc.get_traced_memory()[1] - base
+            finally:
+                tracemalloc.stop()
+            # The table and the sort scratch, not a tuple per entry on top.
+            self.assertLess(peak, size)
+            self.assertEqual(len(list(utxo_set.items())), 20000)
+            utxo_set.close()
+
+    def test_compact_before_spill(self):
+        utxo_set = UtxoSet(memory_budget=200 * 1024, capacity=16)
+        for round in range(10):
+            keys = [outpoint(bytes([round]) * 32, i) for i in range(1000)]
+            for i, key in enumerate(keys):
+                utxo_set.add(key, i, 2, bytes(20))
+            for key in keys[:990]:
+                utxo_set.spend(key)
+        # Spent payloads and empty slots were dropped instead of spilling.
+        self.assertEqual(utxo_set.runs, [])
+        self.assertEqual(utxo_set.table.count, 100)
+        self.assertLessEqual(utxo_set.memory_size(), 200 * 1024)
+
+    def test_spends_budget(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            utxo_set = UtxoSet(memory_budget=16 * 1024, spill_dir=tmp, capacity=16)
+            for i in range(2000):
+                utxo_set.spend(outpoint(i.to_bytes(32, 'little'), 0))
+            self.assertGreater(len(utxo_set.runs), 0)
+            self.assertLessEqual(utxo_set.memory_size(), 16 * 1024)
+            utxo_set.close()
+
+
+if __name__ == '__main__':
+    unittest.main()